@@ -1,33 +1,505 @@
+import argparse
+import collections
+import functools
+import hashlib
+import io
 import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import psycopg2
+from psycopg2.extras import execute_values
+import Ryan_and_Stef_instrument as instrument
+
+DATA_DIR = './Yelp-CptS451'
+DEFAULT_BATCH_SIZE = 50000
+CHUNK_BYTES = 32 * 1024 * 1024
+DEFAULT_COMMIT_EVERY = 100000
+# Parse workers are started fresh rather than forked: stages load on threads
+# holding open connections, and a forked child would inherit their sockets and
+# any lock another thread held at the time
+WORKER_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+# CheckInHistogram slot for (day, hour) is day index * 24 + hour
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+HOURS_PER_WEEK = len(DAYS) * 24
+
+# Column order used for both the per-row INSERTs and the COPY streams
+TABLE_COLUMNS = {
+    'Business': ('business_id', 'name', 'address', 'state', 'city', 'zipcode', 'stars', 'num_reviews', 'is_open'),
+    'BusinessCategory': ('business_id', 'category_id'),
+    'Review': ('review_id', 'business_id', 'stars', 'date', 'text'),
+    'YelpUser': ('user_id', 'review_count'),
+    'CheckIn': ('business_id', 'day', 'time', 'num_checkins'),
+    'CheckInHistogram': ('business_id', 'hours', 'total_checkins'),
+}
+
+DB_SETTINGS = {
+    'host': "localhost",
+    'database': "milestone3db",
+    'user': "postgres",
+    'password': "ramram69",
+}
 
 def connect_to_db():
     try:
-        conn = psycopg2.connect(
-            host="localhost",
-            database="milestone3db",
-            user="postgres",
-            password="ramram69")
+        conn = psycopg2.connect(**DB_SETTINGS, cursor_factory=instrument.InstrumentedCursor)
         return conn
     except (Exception, psycopg2.DatabaseError) as error:
         print(f"Database connection error: {error}")
 
-def parse_file(file_path, parse_function):
+def parse_file(file_path, parse_function, writer, checkpoint, rejects, workers=1, commit_every=DEFAULT_COMMIT_EVERY):
     print(f"Parsing {file_path.split('/')[-1]}...")
-    with open(file_path, 'r') as f:
-        count_line = 0
+    if checkpoint.completed:
+        print(f"Already loaded ({checkpoint.line_number} lines), skipping")
+        return None
+    if checkpoint.offset:
+        print(f"Resuming at line {checkpoint.line_number} (byte {checkpoint.offset})")
+    started = time.perf_counter()
+    if workers > 1:
+        count_line, count_rows = parse_file_parallel(file_path, parse_function, writer, checkpoint, rejects,
+                                                     workers, commit_every)
+    else:
+        count_line, count_rows = parse_file_serial(file_path, parse_function, writer, checkpoint, rejects,
+                                                   commit_every)
+    writer.flush()
+    checkpoint.save(checkpoint.offset, checkpoint.line_number, completed=True)
+    elapsed = time.perf_counter() - started
+    rate = count_rows / elapsed if elapsed > 0 else 0
+    print(f"Parsed {file_path.split('/')[-1]}: {count_line} lines into {count_rows} rows in {elapsed:.1f}s "
+          f"({rate:.0f} rows/sec)")
+    if rejects.count:
+        print(f"{rejects.count} bad lines and refused rows written to {rejects.path}")
+    return {'lines': count_line, 'rows': count_rows, 'seconds': elapsed, 'rows_per_sec': rate,
+            'rejected': rejects.count}
+
+# Returns the rows for one input line, or the error that made it unusable
+def parse_line(line, parse_function):
+    try:
+        return list(parse_function(json.loads(line))), None
+    except (ValueError, KeyError, TypeError, AttributeError) as error:
+        return None, f"{type(error).__name__}: {error}"
+
+def parse_file_serial(file_path, parse_function, writer, checkpoint, rejects, commit_every):
+    count_line = 0
+    count_rows = 0
+    with open(file_path, 'rb') as f:
+        f.seek(checkpoint.offset)
+        offset = checkpoint.offset
+        line_number = checkpoint.line_number
         for line in f:
-            data = json.loads(line)
-            parse_function(data)
+            offset += len(line)
+            line_number += 1
+            rows, error = parse_line(line, parse_function)
+            if error:
+                rejects.write(file_path, line_number, offset - len(line), line, error)
+            else:
+                count_rows += writer.add_rows(rows)
             count_line += 1
-        print(f"Parsed {count_line} lines")
+            if count_line % commit_every == 0:
+                writer.flush()
+                checkpoint.save(offset, line_number)
+    checkpoint.offset = offset
+    checkpoint.line_number = line_number
+    return count_line, count_rows
+
+# Splits the file into byte ranges that start and end on line boundaries, so
+# every line belongs to exactly one chunk
+def chunk_file(file_path, start, num_chunks):
+    size = os.path.getsize(file_path)
+    offsets = [start]
+    with open(file_path, 'rb') as f:
+        for i in range(1, num_chunks):
+            # Small files would otherwise put the first boundaries before start
+            f.seek(max(start, start + (size - start) * i // num_chunks - 1))
+            f.readline()
+            offset = f.tell()
+            if offsets[-1] < offset < size:
+                offsets.append(offset)
+    if offsets[-1] < size:
+        offsets.append(size)
+    return list(zip(offsets, offsets[1:]))
+
+def parse_chunk(file_path, start, end, parse_function):
+    rows = []
+    bad_lines = []
+    count_line = 0
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        position = start
+        while position < end:
+            line = f.readline()
+            if not line:
+                break
+            line_rows, error = parse_line(line, parse_function)
+            if error:
+                bad_lines.append((count_line, position, line, error))
+            else:
+                rows.extend(line_rows)
+            position += len(line)
+            count_line += 1
+    return count_line, position, rows, bad_lines
+
+def parse_file_parallel(file_path, parse_function, writer, checkpoint, rejects, workers, commit_every):
+    size = os.path.getsize(file_path)
+    chunks = chunk_file(file_path, checkpoint.offset, max(workers, -(-(size - checkpoint.offset) // CHUNK_BYTES)))
+    count_line = 0
+    count_rows = 0
+    line_number = checkpoint.line_number
+    offset = checkpoint.offset
+    uncommitted = 0
+    # Workers decode and transform chunks; this process is the single writer.
+    # Results are consumed in file order with at most two chunks per worker in
+    # flight, so the rows written are identical to the serial path
+    with WORKER_CONTEXT.Pool(workers) as pool:
+        remaining = iter(chunks)
+        pending = collections.deque()
+        for start, end in remaining:
+            pending.append(pool.apply_async(parse_chunk, (file_path, start, end, parse_function)))
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            lines, chunk_end, rows, bad_lines = pending.popleft().get()
+            for start, end in remaining:
+                pending.append(pool.apply_async(parse_chunk, (file_path, start, end, parse_function)))
+                break
+            for index, position, line, error in bad_lines:
+                rejects.write(file_path, line_number + index + 1, position, line, error)
+            line_number += lines
+            offset = chunk_end
+            count_line += lines
+            count_rows += writer.add_rows(rows)
+            uncommitted += lines
+            # Chunks are the unit of resumption, so checkpoints land on chunk boundaries
+            if uncommitted >= commit_every:
+                writer.flush()
+                checkpoint.save(offset, line_number)
+                uncommitted = 0
+    if offset != size:
+        raise RuntimeError(f"Parsed up to byte {offset} of {size} in {file_path}")
+    checkpoint.offset = offset
+    checkpoint.line_number = line_number
+    return count_line, count_rows
+
+# Progress for one input file, kept in LoadProgress. Saving a checkpoint commits
+# everything written so far, so a failed run only loses the current batch, and
+# then writes out the rejects found in that batch
+class Checkpoint:
+    def __init__(self, conn, file_name, restart=False, rejects=None):
+        self.conn = conn
+        self.file_name = file_name
+        self.rejects = rejects
+        self.offset = 0
+        self.line_number = 0
+        self.completed = False
+        with conn.cursor() as cur:
+            if restart:
+                cur.execute("DELETE FROM LoadProgress WHERE file_name = %s;", (file_name,))
+            cur.execute("SELECT byte_offset, line_number, completed FROM LoadProgress WHERE file_name = %s;",
+                        (file_name,))
+            progress = cur.fetchone()
+        if progress:
+            self.offset, self.line_number, self.completed = progress
+
+    def save(self, offset, line_number, completed=False):
+        self.offset = offset
+        self.line_number = line_number
+        self.completed = completed
+        with self.conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO LoadProgress (file_name, byte_offset, line_number, completed, updated_at)
+                VALUES (%s, %s, %s, %s, now())
+                ON CONFLICT (file_name) DO UPDATE
+                SET byte_offset = EXCLUDED.byte_offset, line_number = EXCLUDED.line_number,
+                    completed = EXCLUDED.completed, updated_at = EXCLUDED.updated_at;
+            """, (self.file_name, offset, line_number, completed))
+        self.conn.commit()
+        if self.rejects:
+            self.rejects.commit()
+
+# Lines that could not be decoded or transformed, and rows the database
+# refused, appended as JSON lines. They are held until the checkpoint covering
+# them commits, so a batch that is rolled back and loaded again on resume does
+# not report its rejects twice. Stages loading at the same time share the file,
+# so each commit appends its lines in one write under a lock
+class RejectFile:
+    lock = threading.Lock()
+
+    def __init__(self, path, file_name=None):
+        self.path = path
+        self.file_name = file_name
+        self.count = 0
+        self.pending = []
+
+    def write(self, file_path, line_number, offset, line, error):
+        self.pending.append({
+            'file': file_path.split('/')[-1],
+            'line': line_number,
+            'offset': offset,
+            'error': error,
+            'text': line.decode('utf-8', errors='replace').rstrip('\n'),
+        })
+        self.count += 1
+
+    def write_row(self, table, row, error):
+        self.pending.append({'file': self.file_name, 'table': table, 'error': error, 'row': row})
+        self.count += 1
+
+    def commit(self):
+        if not self.pending:
+            return
+        lines = ''.join(json.dumps(reject, default=str) + '\n' for reject in self.pending)
+        with RejectFile.lock, open(self.path, 'a') as f:
+            f.write(lines)
+        self.pending = []
+
+# name -> category_id map, seeded once from Category so the loader never has
+# to look a category up per business
+class CategoryMap:
+    def __init__(self, cur):
+        cur.execute("SELECT name, category_id FROM Category;")
+        self.ids = dict(cur.fetchall())
+
+    def get_id(self, cur, category_name):
+        if category_name not in self.ids:
+            self.create(cur, [category_name])
+        return self.ids[category_name]
+
+    def create(self, cur, names):
+        missing = [name for name in dict.fromkeys(names) if name not in self.ids]
+        if not missing:
+            return
+        execute_values(cur, "INSERT INTO Category (name) VALUES %s ON CONFLICT (name) DO NOTHING;",
+                       [(name,) for name in missing])
+        cur.execute("SELECT name, category_id FROM Category WHERE name = ANY(%s);", (missing,))
+        self.ids.update(cur.fetchall())
+
+def copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, list):
+        # Integer arrays only, which need no quoting inside the braces
+        return '{' + ','.join(str(item) for item in value) + '}'
+    return (str(value).replace('\\', '\\\\')
+                      .replace('\t', '\\t')
+                      .replace('\n', '\\n')
+                      .replace('\r', '\\r'))
+
+# Errors caused by the row itself: bad values, and key, foreign key or check
+# violations. Anything else (a lost connection, a cancel) still aborts the load
+REFUSED_ROW_ERRORS = (psycopg2.DataError, psycopg2.IntegrityError)
+
+def refused_row_error(error):
+    return f"{type(error).__name__}: {' '.join(str(error).split())}"
+
+def copy_rows(cur, table, rows, columns=None):
+    buf = io.StringIO()
+    for row in rows:
+        buf.write('\t'.join(copy_value(value) for value in row))
+        buf.write('\n')
+    buf.seek(0)
+    columns = columns or TABLE_COLUMNS[table]
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buf)
 
-def parseBusinessData(data, cur):
+# Per-row path: one INSERT per row, kept as a fallback for debugging bad input
+class RowWriter:
+    def __init__(self, cur, categories, aggregates=None, rejects=None):
+        self.cur = cur
+        self.categories = categories
+        self.aggregates = aggregates
+        self.rejects = rejects
+
+    def add_rows(self, rows):
+        count = 0
+        for table, row in rows:
+            if self.aggregates:
+                self.aggregates.add(table, row)
+            if table == 'BusinessCategory':
+                row = (row[0], self.categories.get_id(self.cur, row[1]))
+                sql_str = "INSERT INTO BusinessCategory (business_id, category_id) VALUES (%s, %s) ON CONFLICT DO NOTHING;"
+            else:
+                columns = TABLE_COLUMNS[table]
+                sql_str = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+            if self.rejects is None:
+                self.cur.execute(sql_str, row)
+            else:
+                self.cur.execute("SAVEPOINT insert_row;")
+                try:
+                    self.cur.execute(sql_str, row)
+                except REFUSED_ROW_ERRORS as error:
+                    self.cur.execute("ROLLBACK TO SAVEPOINT insert_row;")
+                    if self.aggregates:
+                        self.aggregates.discard(table, row)
+                    self.rejects.write_row(table, row, refused_row_error(error))
+                self.cur.execute("RELEASE SAVEPOINT insert_row;")
+            count += 1
+        return count
+
+    def flush(self):
+        pass
+
+# Bulk path: buffers rows per table and streams them with COPY ... FROM STDIN
+class BulkWriter:
+    def __init__(self, cur, categories, batch_size=DEFAULT_BATCH_SIZE, aggregates=None, rejects=None):
+        self.cur = cur
+        self.categories = categories
+        self.aggregates = aggregates
+        self.rejects = rejects
+        self.batch_size = batch_size
+        self.buffers = {}
+        self.buffered = 0
+        self.rejected = []
+
+    def add_rows(self, rows):
+        count = 0
+        for table, row in rows:
+            if self.aggregates:
+                self.aggregates.add(table, row)
+            self.buffers.setdefault(table, []).append(row)
+            count += 1
+        self.buffered += count
+        if self.buffered >= self.batch_size:
+            self.flush()
+        return count
+
+    def flush(self):
+        self.rejected = []
+        # Tables are flushed in the order they were first seen, so Business rows
+        # always reach the database before the BusinessCategory rows that reference them
+        for table, rows in self.buffers.items():
+            if not rows:
+                continue
+            if table == 'BusinessCategory':
+                # New categories for the whole batch are created in one statement
+                self.categories.create(self.cur, [name for _, name in rows])
+                ids = self.categories.ids
+                rows = [(business_id, ids[name]) for business_id, name in rows]
+            self.write_batch(table, rows)
+        self.buffers = {}
+        self.buffered = 0
+
+    # A batch the database refuses (a review of a missing business, a duplicate
+    # key) is split in half and each half retried under its own savepoint, down
+    # to the single rows that still fail. Those go to the reject file instead of
+    # aborting the load, and a batch with k bad rows costs about k * log2(n) COPYs
+    def write_batch(self, table, rows):
+        if self.rejects is None:
+            return self.write(table, rows)
+        self.cur.execute("SAVEPOINT write_batch;")
+        try:
+            self.write(table, rows)
+        except REFUSED_ROW_ERRORS as error:
+            self.cur.execute("ROLLBACK TO SAVEPOINT write_batch;")
+            self.cur.execute("RELEASE SAVEPOINT write_batch;")
+            if len(rows) == 1:
+                self.reject(table, rows[0], error)
+            else:
+                middle = len(rows) // 2
+                self.write_batch(table, rows[:middle])
+                self.write_batch(table, rows[middle:])
+            return
+        self.cur.execute("RELEASE SAVEPOINT write_batch;")
+
+    def write(self, table, rows):
+        copy_rows(self.cur, table, rows)
+
+    def reject(self, table, row, error):
+        if self.aggregates:
+            self.aggregates.discard(table, row)
+        self.rejected.append((table, row))
+        self.rejects.write_row(table, row, refused_row_error(error))
+
+# Delta path for reloading a refreshed dump: each record's rows are
+# fingerprinted and compared with RecordFingerprint in one query per batch.
+# Unchanged records are skipped; the rows of new or changed ones are deleted
+# and rewritten, except Business rows, which are upserted so the rows that
+# reference them stay put. Every parser leads each row with its record's key,
+# so a record is the run of rows sharing row[0]
+class DeltaWriter(BulkWriter):
+    def __init__(self, cur, categories, source, parse_function, batch_size=DEFAULT_BATCH_SIZE, aggregates=None,
+                 rejects=None):
+        super().__init__(cur, categories, batch_size, aggregates, rejects)
+        self.source = source
+        self.tables = RECORD_TABLES[parse_function]
+        self.records = {}
+        self.counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS delta_fingerprint (record_key TEXT PRIMARY KEY, "
+                    "fingerprint BYTEA NOT NULL) ON COMMIT DELETE ROWS;")
+        if aggregates:
+            aggregates.changed_only = True
+
+    def add_rows(self, rows):
+        count = 0
+        for table, row in rows:
+            self.records.setdefault(row[0], []).append((table, row))
+            count += 1
+        self.buffered += count
+        if self.buffered >= self.batch_size:
+            self.flush()
+        return count
+
+    def flush(self):
+        if not self.records:
+            return
+        self.cur.execute("TRUNCATE delta_fingerprint;")
+        copy_rows(self.cur, 'delta_fingerprint',
+                  ((key, '\\x' + hashlib.blake2b(json.dumps(rows).encode(), digest_size=16).hexdigest())
+                   for key, rows in self.records.items()),
+                  ('record_key', 'fingerprint'))
+        self.cur.execute(CHANGED_RECORDS_SQL, (self.source,))
+        changed = dict(self.cur.fetchall())
+        inserted = sum(changed.values())
+        self.counts['inserted'] += inserted
+        self.counts['updated'] += len(changed) - inserted
+        self.counts['unchanged'] += len(self.records) - len(changed)
+        if changed:
+            keys = list(changed)
+            # Records without a fingerprint may still have rows from a load made
+            # without --delta, so they are cleared too
+            for table in self.tables:
+                if table in UPSERT_TABLES:
+                    continue
+                key_column = TABLE_COLUMNS[table][0]
+                if 'business_id' in TABLE_COLUMNS[table] and key_column != 'business_id':
+                    # A changed review may have moved; its old business needs recomputing as well
+                    self.cur.execute(f"DELETE FROM {table} WHERE {key_column} = ANY(%s) RETURNING business_id;",
+                                     (keys,))
+                    if self.aggregates:
+                        self.aggregates.touch(business_id for business_id, in self.cur.fetchall())
+                else:
+                    self.cur.execute(f"DELETE FROM {table} WHERE {key_column} = ANY(%s);", (keys,))
+            self.buffers = {table: [] for table in self.tables}
+            for key in keys:
+                for table, row in self.records[key]:
+                    if self.aggregates:
+                        self.aggregates.add(table, row)
+                    self.buffers[table].append(row)
+            super().flush()
+            # A record with a rejected row keeps its old fingerprint, so the next delta load retries it
+            refused = {row[0] for _, row in self.rejected}
+            self.cur.execute(SAVE_FINGERPRINTS_SQL, (self.source, [key for key in keys if key not in refused]))
+        self.records = {}
+        self.buffers = {}
+        self.buffered = 0
+
+    def write(self, table, rows):
+        if table not in UPSERT_TABLES:
+            return super().write(table, rows)
+        columns = TABLE_COLUMNS[table]
+        updates = ', '.join(f"{column} = EXCLUDED.{column}" for column in columns[1:])
+        execute_values(self.cur, f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s "
+                                 f"ON CONFLICT ({columns[0]}) DO UPDATE SET {updates};", rows)
+        if self.aggregates and table == 'Business':
+            # The upsert overwrote num_reviews/stars with the dump's values
+            self.aggregates.touch(row[0] for row in rows)
+
+def parseBusinessData(data):
     is_open_bool = True if data['is_open'] == 1 else False
-    sql_str = """INSERT INTO Business 
-                 (business_id, name, address, state, city, zipcode, stars, num_reviews, is_open) 
-                 VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)"""
-    cur.execute(sql_str, (
+    yield 'Business', (
         data['business_id'],
         data['name'],
         data.get('address', ''),
@@ -37,65 +509,516 @@ def parseBusinessData(data, cur):
         data['stars'],
         data['review_count'],
         is_open_bool
-    ))
+    )
 
+    # Categories are emitted by name and resolved to a category_id by the writer
     categories = data.get('categories', [])
     if categories:
-        for category_name in categories:
-            cur.execute("SELECT category_id FROM Category WHERE name = %s;", (category_name,))
-            category_result = cur.fetchone()
-            if category_result:
-                category_id = category_result[0]
-            else:
-                cur.execute("INSERT INTO Category (name) VALUES (%s) RETURNING category_id;", (category_name,))
-                category_id = cur.fetchone()[0]
-            cur.execute("INSERT INTO BusinessCategory (business_id, category_id) VALUES (%s, %s) ON CONFLICT DO NOTHING;",
-                        (data['business_id'], category_id))
+        for category_name in dict.fromkeys(categories):
+            yield 'BusinessCategory', (data['business_id'], category_name)
 
 
-def parseReviewData(data, cur):
-    sql_str = "INSERT INTO Review (review_id, business_id, stars, date, text) VALUES (%s, %s, %s, %s, %s)"
-    cur.execute(sql_str, (
+def parseReviewData(data):
+    yield 'Review', (
         data['review_id'],
         data['business_id'],
         data['stars'],
         data['date'],
         data['text']
-    ))
+    )
 
-def parseUserData(data, cur):
-    sql_str = "INSERT INTO YelpUser (user_id, review_count) VALUES (%s, %s)"
-    cur.execute(sql_str, (
+def parseUserData(data):
+    yield 'YelpUser', (
         data['user_id'],
         data['review_count']
-    ))
+    )
 
-def parseCheckinData(data, cur):
+def parseCheckinData(data):
     for day, times in data['time'].items():
         for hour, count in times.items():
-            sql_str = "INSERT INTO CheckIn (business_id, day, time, num_checkins) VALUES (%s, %s, %s, %s)"
-            cur.execute(sql_str, (
+            yield 'CheckIn', (
                 data['business_id'],
                 day,
                 hour,
                 count
-            ))
+            )
+
+# One CheckInHistogram row per business instead of one CheckIn row per (day, hour)
+def parseCheckinHistogram(data):
+    hours = [0] * HOURS_PER_WEEK
+    for day, times in data['time'].items():
+        day_index = DAYS.index(day)
+        for hour, count in times.items():
+            hours[day_index * 24 + int(hour.split(':')[0])] += count
+    yield 'CheckInHistogram', (data['business_id'], hours, sum(hours))
+
+def parseCheckinBoth(data):
+    yield from parseCheckinData(data)
+    yield from parseCheckinHistogram(data)
+
+CHECKIN_PARSERS = {
+    'rows': parseCheckinData,
+    'histogram': parseCheckinHistogram,
+    'both': parseCheckinBoth,
+}
+
+# Tables each parser writes for one record. Their first column is the record key
+RECORD_TABLES = {
+    parseBusinessData: ('Business', 'BusinessCategory'),
+    parseReviewData: ('Review',),
+    parseUserData: ('YelpUser',),
+    parseCheckinData: ('CheckIn',),
+    parseCheckinHistogram: ('CheckInHistogram',),
+    parseCheckinBoth: ('CheckIn', 'CheckInHistogram'),
+}
+# Deleting a Business row would cascade to, or be blocked by, the rows of other files
+UPSERT_TABLES = {'Business'}
+
+# Records in delta_fingerprint whose fingerprint is missing (true) or different (false)
+CHANGED_RECORDS_SQL = """
+    SELECT d.record_key, f.fingerprint IS NULL
+    FROM delta_fingerprint d
+    LEFT JOIN RecordFingerprint f ON f.source = %s AND f.record_key = d.record_key
+    WHERE f.fingerprint IS DISTINCT FROM d.fingerprint;
+"""
+
+SAVE_FINGERPRINTS_SQL = """
+    INSERT INTO RecordFingerprint (source, record_key, fingerprint)
+    SELECT %s, record_key, fingerprint FROM delta_fingerprint WHERE record_key = ANY(%s)
+    ON CONFLICT (source, record_key) DO UPDATE SET fingerprint = EXCLUDED.fingerprint;
+"""
+
+# Business aggregates (num_reviews, stars, num_checkins) accumulated while the
+# review and checkin files stream through the writer, then applied with one
+# set-based UPDATE per table instead of correlated subqueries per Business row.
+# Checkin totals are taken from checkin_table, CheckIn or CheckInHistogram.
+# Stages loading side by side share one instance: each dict is only written by
+# the stage loading its table. Delta loads only see changed rows, so they set
+# changed_only and the totals are recomputed for the businesses touched
+class Aggregates:
+    def __init__(self, checkin_table='CheckIn'):
+        self.checkin_table = checkin_table
+        self.reviews = {}
+        self.checkins = {}
+        self.stale = set()
+        self.loaded = set()
+        self.partial = False
+        self.changed_only = False
+
+    def add(self, table, row):
+        if table == 'Review':
+            totals = self.reviews.get(row[1])
+            if totals is None:
+                self.reviews[row[1]] = [1, row[2]]
+            else:
+                totals[0] += 1
+                totals[1] += row[2]
+        elif table == self.checkin_table:
+            count = row[3] if table == 'CheckIn' else row[2]
+            self.checkins[row[0]] = self.checkins.get(row[0], 0) + count
+
+    # Takes back a row that was added but then refused by the database
+    def discard(self, table, row):
+        if table == 'Review':
+            totals = self.reviews.get(row[1])
+            if totals:
+                totals[0] -= 1
+                totals[1] -= row[2]
+                if totals[0] == 0:
+                    del self.reviews[row[1]]
+        elif table == self.checkin_table and row[0] in self.checkins:
+            self.checkins[row[0]] -= row[3] if table == 'CheckIn' else row[2]
+
+    def file_loaded(self, parse_function, resumed):
+        table = AGGREGATED_TABLES.get(parse_function)
+        if table:
+            self.loaded.add(table)
+            # A resumed or skipped file was only partly seen by this process
+            self.partial = self.partial or resumed
+
+    # Businesses whose totals need recomputing although none of their new rows
+    # were seen: upserted Business rows and the old business of a moved review
+    def touch(self, business_ids):
+        self.stale.update(business_ids)
+        self.loaded.update(('Review', self.checkin_table))
+
+    def touched(self):
+        return self.reviews.keys() | self.checkins.keys() | self.stale
+
+    def apply(self, cur, mode):
+        if not self.loaded or mode == 'off':
+            return
+        started = time.perf_counter()
+        if self.partial:
+            self.apply_from_tables(cur)
+        elif mode == 'incremental' or self.changed_only:
+            mode = 'incremental'
+            self.apply_incremental(cur)
+        else:
+            self.apply_totals(cur)
+        print(f"Updated Business aggregates ({mode}, {len(self.touched())} businesses touched) "
+              f"in {time.perf_counter() - started:.1f}s")
+
+    def apply_totals(self, cur):
+        if 'Review' in self.loaded:
+            cur.execute("CREATE TEMP TABLE review_totals (business_id TEXT PRIMARY KEY, num_reviews INTEGER, "
+                        "star_sum FLOAT) ON COMMIT DROP;")
+            copy_rows(cur, 'review_totals', ((business_id, count, star_sum)
+                                             for business_id, (count, star_sum) in self.reviews.items()),
+                      ('business_id', 'num_reviews', 'star_sum'))
+            cur.execute(REVIEW_TOTALS_SQL)
+        if self.checkin_table in self.loaded:
+            cur.execute("CREATE TEMP TABLE checkin_totals (business_id TEXT PRIMARY KEY, num_checkins INTEGER) "
+                        "ON COMMIT DROP;")
+            copy_rows(cur, 'checkin_totals', self.checkins.items(), ('business_id', 'num_checkins'))
+            cur.execute(CHECKIN_TOTALS_SQL)
+
+    def apply_from_tables(self, cur):
+        if 'Review' in self.loaded:
+            cur.execute(REVIEW_RECOMPUTE_SQL)
+        if self.checkin_table in self.loaded:
+            cur.execute(CHECKIN_RECOMPUTE_SQL if self.checkin_table == 'CheckIn' else HISTOGRAM_RECOMPUTE_SQL)
+
+    # Recomputes only the businesses that received new reviews or checkins
+    def apply_incremental(self, cur):
+        cur.execute("CREATE TEMP TABLE touched_business (business_id TEXT PRIMARY KEY) ON COMMIT DROP;")
+        copy_rows(cur, 'touched_business', ((business_id,) for business_id in self.touched()), ('business_id',))
+        cur.execute("ANALYZE touched_business;")
+        if 'Review' in self.loaded:
+            cur.execute(REVIEW_INCREMENTAL_SQL)
+        if self.checkin_table in self.loaded:
+            cur.execute(CHECKIN_INCREMENTAL_SQL if self.checkin_table == 'CheckIn' else HISTOGRAM_INCREMENTAL_SQL)
+
+REVIEW_TOTALS_SQL = """
+    UPDATE Business b SET num_reviews = 0, stars = 0
+    WHERE NOT EXISTS (SELECT 1 FROM review_totals t WHERE t.business_id = b.business_id);
+    UPDATE Business b SET num_reviews = t.num_reviews, stars = t.star_sum / t.num_reviews
+    FROM review_totals t WHERE b.business_id = t.business_id;
+"""
+
+CHECKIN_TOTALS_SQL = """
+    UPDATE Business b SET num_checkins = 0
+    WHERE NOT EXISTS (SELECT 1 FROM checkin_totals t WHERE t.business_id = b.business_id);
+    UPDATE Business b SET num_checkins = t.num_checkins
+    FROM checkin_totals t WHERE b.business_id = t.business_id;
+"""
+
+REVIEW_RECOMPUTE_SQL = """
+    UPDATE Business b SET num_reviews = COALESCE(r.num_reviews, 0), stars = COALESCE(r.avg_stars, 0)
+    FROM Business b2
+    LEFT JOIN (SELECT business_id, COUNT(*) AS num_reviews, AVG(stars) AS avg_stars
+               FROM Review GROUP BY business_id) r ON r.business_id = b2.business_id
+    WHERE b.business_id = b2.business_id;
+"""
+
+CHECKIN_RECOMPUTE_SQL = """
+    UPDATE Business b SET num_checkins = COALESCE(ci.num_checkins, 0)
+    FROM Business b2
+    LEFT JOIN (SELECT business_id, SUM(num_checkins) AS num_checkins
+               FROM CheckIn GROUP BY business_id) ci ON ci.business_id = b2.business_id
+    WHERE b.business_id = b2.business_id;
+"""
+
+REVIEW_INCREMENTAL_SQL = """
+    UPDATE Business b SET num_reviews = COALESCE(r.num_reviews, 0), stars = COALESCE(r.avg_stars, 0)
+    FROM touched_business t
+    LEFT JOIN (SELECT business_id, COUNT(*) AS num_reviews, AVG(stars) AS avg_stars
+               FROM Review WHERE business_id IN (SELECT business_id FROM touched_business)
+               GROUP BY business_id) r ON r.business_id = t.business_id
+    WHERE b.business_id = t.business_id;
+"""
+
+CHECKIN_INCREMENTAL_SQL = """
+    UPDATE Business b SET num_checkins = COALESCE(ci.num_checkins, 0)
+    FROM touched_business t
+    LEFT JOIN (SELECT business_id, SUM(num_checkins) AS num_checkins
+               FROM CheckIn WHERE business_id IN (SELECT business_id FROM touched_business)
+               GROUP BY business_id) ci ON ci.business_id = t.business_id
+    WHERE b.business_id = t.business_id;
+"""
+
+HISTOGRAM_RECOMPUTE_SQL = """
+    UPDATE Business b SET num_checkins = COALESCE(h.total_checkins, 0)
+    FROM Business b2
+    LEFT JOIN CheckInHistogram h ON h.business_id = b2.business_id
+    WHERE b.business_id = b2.business_id;
+"""
+
+HISTOGRAM_INCREMENTAL_SQL = """
+    UPDATE Business b SET num_checkins = COALESCE(h.total_checkins, 0)
+    FROM touched_business t
+    LEFT JOIN CheckInHistogram h ON h.business_id = t.business_id
+    WHERE b.business_id = t.business_id;
+"""
+
+AGGREGATED_TABLES = {
+    parseReviewData: 'Review',
+    parseCheckinData: 'CheckIn',
+    parseCheckinHistogram: 'CheckInHistogram',
+    parseCheckinBoth: 'CheckInHistogram',
+}
+
+# Input files in load order, with their parser; checkins are parsed as rows,
+# histograms or both following --checkin-storage
+LOAD_FILES = {
+    'yelp_business.JSON': parseBusinessData,
+    'yelp_user.JSON': parseUserData,
+    'yelp_review.JSON': parseReviewData,
+    'yelp_checkin.JSON': None,
+}
+
+# The files each file has to wait for. Reviews and checkins reference Business
+# through foreign keys; users reference nothing
+LOAD_DEPENDENCIES = {
+    'yelp_business.JSON': (),
+    'yelp_user.JSON': (),
+    'yelp_review.JSON': ('yelp_business.JSON',),
+    'yelp_checkin.JSON': ('yelp_business.JSON',),
+}
+
+# Tables written by a file whose foreign keys point at another file's tables.
+# With --defer-fk these are dropped for the load, so no file has to wait
+FOREIGN_KEY_TABLES = {
+    'yelp_review.JSON': ('Review',),
+    'yelp_checkin.JSON': ('CheckIn', 'CheckInHistogram'),
+}
+
+def file_parser(file_name, args):
+    return LOAD_FILES[file_name] or CHECKIN_PARSERS[args.checkin_storage]
+
+# The files to load and what each waits for, limited to the files selected
+def load_plan(args):
+    files = args.files or list(LOAD_FILES)
+    return {file_name: () if args.defer_fk else
+            tuple(dependency for dependency in LOAD_DEPENDENCIES[file_name] if dependency in files)
+            for file_name in LOAD_FILES if file_name in files}
+
+def load_file(conn, cur, file_name, parse_function, categories, aggregates, args):
+    rejects = RejectFile(args.reject_file, file_name)
+    if args.delta:
+        writer = DeltaWriter(cur, categories, file_name, parse_function, args.batch_size, aggregates, rejects)
+    elif args.row_mode:
+        writer = RowWriter(cur, categories, aggregates, rejects)
+    else:
+        writer = BulkWriter(cur, categories, args.batch_size, aggregates, rejects)
+    # A delta run reads a new dump, so it never skips a file loaded by an earlier run
+    checkpoint = Checkpoint(conn, file_name, args.restart or args.delta, rejects)
+    resumed = checkpoint.offset > 0 or checkpoint.completed
+    stats = parse_file(f'{args.data_dir}/{file_name}', parse_function, writer, checkpoint, rejects,
+                       args.workers, args.commit_every)
+    aggregates.file_loaded(parse_function, resumed)
+    if args.delta and stats:
+        stats.update(writer.counts)
+        print(f"{file_name}: {writer.counts['inserted']} inserted, {writer.counts['updated']} updated, "
+              f"{writer.counts['unchanged']} unchanged")
+    return stats
+
+# One stage of the load, on its own connection so stages can run side by side
+def load_stage(file_name, args, aggregates):
+    conn = connect_to_db()
+    if conn is None:
+        raise RuntimeError(f"no database connection for {file_name}")
+    cur = conn.cursor()
+    try:
+        categories = CategoryMap(cur)
+        return load_file(conn, cur, file_name, file_parser(file_name, args), categories, aggregates, args)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+# Starts each stage as soon as every stage it depends on has finished. After a
+# failure no new stage is started; the running ones finish (each commits its own
+# checkpoints) and the first error is raised. Returns name -> timing and stats
+def run_stages(dependencies, run_stage):
+    started = time.perf_counter()
+
+    def timed(name):
+        stage_started = time.perf_counter()
+        result = run_stage(name)
+        return dict(result or {'skipped': True}, start=stage_started - started,
+                    seconds=time.perf_counter() - stage_started)
+
+    pending = dict(dependencies)
+    finished = set()
+    running = {}
+    timings = {}
+    failure = None
+    with ThreadPoolExecutor(max_workers=max(len(dependencies), 1)) as executor:
+        while True:
+            if failure is None:
+                for name in [name for name, needs in pending.items() if finished.issuperset(needs)]:
+                    del pending[name]
+                    running[executor.submit(timed, name)] = name
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    timings[name] = future.result()
+                    finished.add(name)
+                except Exception as error:
+                    print(f"{name} failed: {error}")
+                    failure = failure or error
+    if failure:
+        raise failure
+    if pending:
+        raise ValueError(f"Dependency cycle between {', '.join(pending)}")
+    return timings
+
+FOREIGN_KEYS_SQL = """
+    SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid)
+    FROM pg_constraint
+    WHERE contype = 'f'
+      AND conrelid = ANY(ARRAY(SELECT to_regclass(name) FROM unnest(%s::text[]) AS name));
+"""
+
+# Drops the foreign keys of the tables in FOREIGN_KEY_TABLES, returning what is
+# needed to put them back. The definitions are printed in case the process dies
+# before restore_foreign_keys runs
+def drop_foreign_keys(conn, cur, file_names):
+    tables = [table for file_name in file_names for table in FOREIGN_KEY_TABLES.get(file_name, ())]
+    if not tables:
+        return []
+    cur.execute(FOREIGN_KEYS_SQL, (tables,))
+    constraints = cur.fetchall()
+    for table, name, definition in constraints:
+        print(f"Deferring {table}.{name}: {definition}")
+        cur.execute(f'ALTER TABLE {table} DROP CONSTRAINT "{name}";')
+    conn.commit()
+    return constraints
+
+# Re-adds the dropped foreign keys as NOT VALID, which only checks rows written
+# from now on, so this is instant whether or not the load succeeded
+def restore_foreign_keys(conn, cur, constraints):
+    conn.rollback()
+    for table, name, definition in constraints:
+        cur.execute(f'ALTER TABLE {table} ADD CONSTRAINT "{name}" {definition} NOT VALID;')
+    conn.commit()
+
+# One scan per table checks the loaded rows, taking a lock that still allows
+# reads and writes. A violation leaves the constraint NOT VALID and is raised
+def validate_foreign_keys(conn, cur, constraints):
+    for table, name, _ in constraints:
+        cur.execute(f'ALTER TABLE {table} VALIDATE CONSTRAINT "{name}";')
+        conn.commit()
+
+# Loads the selected files following load_plan, returning the timing of every
+# stage including foreign key validation
+def load_files(conn, cur, args, aggregates):
+    plan = load_plan(args)
+    constraints = drop_foreign_keys(conn, cur, plan) if args.defer_fk else []
+    try:
+        timings = run_stages(plan, functools.partial(load_stage, args=args, aggregates=aggregates))
+    finally:
+        if constraints:
+            restore_foreign_keys(conn, cur, constraints)
+    if constraints:
+        started = time.perf_counter()
+        validate_foreign_keys(conn, cur, constraints)
+        timings['validate_foreign_keys'] = {'start': None, 'seconds': time.perf_counter() - started}
+    return timings
+
+def print_timings(timings):
+    print(f"\n{'stage':<24} {'start':>8} {'seconds':>8} {'rows':>10} {'rows/sec':>10}")
+    for name, timing in timings.items():
+        start = '' if timing.get('start') is None else f"{timing['start']:.1f}"
+        rows = 'skipped' if timing.get('skipped') else timing.get('rows', '')
+        rate = f"{timing['rows_per_sec']:.0f}" if 'rows_per_sec' in timing else ''
+        print(f"{name:<24} {start:>8} {timing['seconds']:>8.1f} {rows:>10} {rate:>10}")
+
+# BusinessSummary backs the UI's business panels. CONCURRENTLY keeps it
+# readable while it is rebuilt
+def refresh_summary(cur):
+    started = time.perf_counter()
+    cur.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY BusinessSummary;")
+    print(f"Refreshed BusinessSummary in {time.perf_counter() - started:.1f}s")
+
+# Tells UI caches stamped with an older generation that the data has changed
+def bump_generation(cur):
+    cur.execute("UPDATE DataGeneration SET generation = generation + 1, updated_at = now() RETURNING generation;")
+    print(f"Data generation is now {cur.fetchone()[0]}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load the Yelp JSON files into Postgres")
+    parser.add_argument('--data-dir', default=DATA_DIR,
+                        help=f"directory holding the yelp_*.JSON files (default {DATA_DIR})")
+    parser.add_argument('--database', default=DB_SETTINGS['database'],
+                        help=f"database to load into (default {DB_SETTINGS['database']})")
+    parser.add_argument('--files', nargs='+', choices=list(LOAD_FILES), metavar='FILE',
+                        help="only load these files (default all); files they depend on are not waited for "
+                             "unless also selected")
+    parser.add_argument('--defer-fk', action='store_true',
+                        help="drop the Review/CheckIn foreign keys for the load so every file loads at once, "
+                             "then re-add them NOT VALID and VALIDATE them at the end")
+    parser.add_argument('--row-mode', action='store_true',
+                        help="insert one row at a time instead of using COPY (slow, for debugging)")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"rows buffered per COPY batch (default {DEFAULT_BATCH_SIZE})")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="processes used to decode and transform each file; files loading side by side "
+                             "each start their own (default 1, serial)")
+    parser.add_argument('--commit-every', type=int, default=DEFAULT_COMMIT_EVERY,
+                        help=f"input lines per transaction/checkpoint (default {DEFAULT_COMMIT_EVERY})")
+    parser.add_argument('--reject-file', default='rejects.jsonl',
+                        help="where lines that fail to parse and rows the database refuses are written "
+                             "(default rejects.jsonl)")
+    parser.add_argument('--delta', action='store_true',
+                        help="reload a refreshed dump, writing only records that are new or changed since the "
+                             "last --delta load and recomputing aggregates for the businesses touched; needs "
+                             "migration V004. The first delta load rewrites every record")
+    parser.add_argument('--restart', action='store_true',
+                        help="ignore saved checkpoints and load each file from the beginning")
+    parser.add_argument('--aggregates', choices=['full', 'incremental', 'off'], default='full',
+                        help="how Business num_reviews/stars/num_checkins are maintained after the load: "
+                             "full rewrites every business, incremental only the businesses touched (default full)")
+    parser.add_argument('--checkin-storage', choices=sorted(CHECKIN_PARSERS), default='rows',
+                        help="load checkins as one CheckIn row per (day, hour), one 168-slot CheckInHistogram "
+                             "row per business, or both; needs migration V002 for histogram (default rows)")
+    parser.add_argument('--refresh-summary', action='store_true',
+                        help="only refresh the BusinessSummary view, without loading any files")
+    parser.add_argument('--no-summary', action='store_true',
+                        help="skip refreshing BusinessSummary after the load")
+    return parser.parse_args(argv)
 
 def main():
+    args = parse_args()
+    DB_SETTINGS['database'] = args.database
+    instrument.install('loader_query_stats.json')
     conn = connect_to_db()
     if conn is None:
         return
     cur = conn.cursor()
 
     try:
-        #parse_file('./Yelp-CptS451/yelp_business.JSON', lambda data: parseBusinessData(data, cur))
-        parse_file('./Yelp-CptS451/yelp_review.JSON', lambda data: parseReviewData(data, cur))
-        #parse_file('./Yelp-CptS451/yelp_user.JSON', lambda data: parseUserData(data, cur))
-        #parse_file('./Yelp-CptS451/yelp_checkin.JSON', lambda data: parseCheckinData(data, cur))
+        if args.refresh_summary:
+            refresh_summary(cur)
+            bump_generation(cur)
+            conn.commit()
+            return
+        aggregates = Aggregates('CheckIn' if args.checkin_storage == 'rows' else 'CheckInHistogram')
+        started = time.perf_counter()
+        timings = load_files(conn, cur, args, aggregates)
+        stage_started = time.perf_counter()
+        aggregates.apply(cur, args.aggregates)
+        conn.commit()
+        timings['aggregates'] = {'start': None, 'seconds': time.perf_counter() - stage_started}
+        if not args.no_summary:
+            stage_started = time.perf_counter()
+            refresh_summary(cur)
+            timings['refresh_summary'] = {'start': None, 'seconds': time.perf_counter() - stage_started}
+        bump_generation(cur)
         conn.commit()
+        print_timings(timings)
+        print(f"Loaded in {time.perf_counter() - started:.1f}s")
     except Exception as e:
         print(f"An error occurred: {e}")
+        # Only the batch since the last checkpoint is lost; rerunning resumes from there
         conn.rollback()
+        print("Rolled back to the last checkpoint, rerun to resume")
     finally:
         cur.close()
         conn.close()
@@ -0,0 +1,756 @@
+import argparse
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+import psycopg2
+import psycopg2.extensions
+import Ryan_and_Stef_instrument as instrument
+
+DB_SETTINGS = dict(
+    host="localhost",
+    database="milestone3db",
+    user="postgres",
+    password="ramram69")
+POOL_MIN_CONNECTIONS = 1
+POOL_MAX_CONNECTIONS = 8
+# Connections idle for longer than this are pinged before being handed out
+POOL_HEALTH_CHECK_AFTER = 30
+LOCATION_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'location_cache.json')
+# Zipcode panel result cache: entry limit, entry lifetime in seconds, and how
+# long a DataGeneration reading is trusted before it is checked again
+CACHE_MAX_ENTRIES = 256
+CACHE_TTL = 600
+CACHE_GENERATION_CHECK_INTERVAL = 5
+# Rows fetched per page of a listing
+PAGE_SIZE = 100
+# Rows per batch when a listing is streamed from a server-side cursor
+STREAM_BATCH_SIZE = 500
+# Businesses returned by a review search
+SEARCH_LIMIT = 50
+# Checkin histograms have one slot per (day, hour), Monday first
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# Connections carry the names of the statements already prepared on them
+class PooledConnection(psycopg2.extensions.connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.last_used = time.monotonic()
+
+# Connections are opened on demand, up to maxconn, and kept open once returned:
+# psycopg2's pools close every connection beyond minconn on return, which would
+# reconnect and lose the prepared statements on most checkouts
+class ConnectionPool:
+    def __init__(self, minconn, maxconn, **settings):
+        self.settings = settings
+        self.idle = []
+        self.lock = threading.Lock()
+        # The semaphore bounds the open connections and makes callers wait for one
+        self.available = threading.BoundedSemaphore(maxconn)
+        for _ in range(minconn):
+            self.idle.append(self.connect())
+
+    def connect(self):
+        return psycopg2.connect(connection_factory=PooledConnection,
+                                cursor_factory=instrument.InstrumentedCursor, **self.settings)
+
+    def getconn(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        return self.connect()
+
+    def putconn(self, conn, close=False):
+        if close or conn.closed:
+            if not conn.closed:
+                conn.close()
+            return
+        with self.lock:
+            self.idle.append(conn)
+
+    def closeall(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
+
+    # Also puts the connection in autocommit mode, before any ping, so the ping
+    # cannot leave a transaction open
+    def healthy(self, conn):
+        if conn.closed:
+            return False
+        try:
+            if not conn.autocommit:
+                conn.rollback()
+                conn.autocommit = True
+            if time.monotonic() - conn.last_used < POOL_HEALTH_CHECK_AFTER:
+                return True
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            return True
+        except psycopg2.Error:
+            return False
+
+    @contextmanager
+    def connection(self):
+        started = time.perf_counter()
+        self.available.acquire()
+        conn = None
+        try:
+            conn = self.getconn()
+            while not self.healthy(conn):
+                self.putconn(conn, close=True)
+                conn = self.getconn()
+            instrument.stats.record_wait((time.perf_counter() - started) * 1000)
+            yield conn
+        except psycopg2.extensions.QueryCanceledError:
+            # A cancelled query leaves the connection usable
+            raise
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # The connection is unusable; drop it so the pool opens a fresh one
+            if conn is not None:
+                self.putconn(conn, close=True)
+                conn = None
+            raise
+        finally:
+            if conn is not None:
+                conn.last_used = time.monotonic()
+                self.putconn(conn)
+            self.available.release()
+
+db_pool = None
+db_pool_lock = threading.Lock()
+
+def get_pool():
+    global db_pool
+    with db_pool_lock:
+        if db_pool is None:
+            db_pool = ConnectionPool(POOL_MIN_CONNECTIONS, POOL_MAX_CONNECTIONS, **DB_SETTINGS)
+    return db_pool
+
+# Businesses at or above their zipcode's average stars and average checkins.
+# The zipcode baselines are window aggregates, computed once per zipcode in the
+# same pass instead of by correlated subqueries per group
+POPULAR_IN_ZIPCODE = """
+    WITH scored AS (
+        SELECT b.business_id, b.name, b.stars, s.total_checkins,
+               AVG(b.stars) OVER zipcode AS zipcode_avg_stars,
+               AVG(s.total_checkins) FILTER (WHERE s.total_checkins > 0) OVER zipcode AS zipcode_avg_checkins
+        FROM Business b
+        JOIN BusinessSummary s ON s.business_id = b.business_id
+        WHERE b.zipcode = $1
+        WINDOW zipcode AS (PARTITION BY b.zipcode)
+    ),
+    popular AS (
+        SELECT * FROM scored
+        WHERE total_checkins > 0
+          AND stars >= zipcode_avg_stars
+          AND total_checkins >= zipcode_avg_checkins
+    )
+"""
+
+# Businesses whose reviews match a web-style search ($1), ranked by the summed
+# relevance of their matching reviews, with a snippet from the best one. The
+# match goes through the GIN index on Review.text_search (migration V003), and
+# ts_headline only runs on the returned page
+def review_search(location_filter, limit_parameter):
+    return f"""
+        WITH search AS (
+            SELECT websearch_to_tsquery('english', $1) AS query
+        ),
+        matches AS (
+            SELECT r.business_id, r.review_id, ts_rank(r.text_search, search.query) AS rank
+            FROM Review r
+            JOIN Business b ON b.business_id = r.business_id
+            CROSS JOIN search
+            WHERE r.text_search @@ search.query AND {location_filter}
+        ),
+        ranked AS (
+            SELECT business_id, SUM(rank) AS relevance, COUNT(*) AS matching_reviews,
+                   (array_agg(review_id ORDER BY rank DESC, review_id))[1] AS best_review_id
+            FROM matches
+            GROUP BY business_id
+            ORDER BY relevance DESC, business_id
+            LIMIT {limit_parameter}
+        )
+        SELECT b.name, b.address, ranked.matching_reviews, ROUND(ranked.relevance::numeric, 3),
+               ts_headline('english', r.text, search.query,
+                           'StartSel=[, StopSel=], MaxFragments=1, MinWords=8, MaxWords=25'),
+               b.business_id
+        FROM ranked
+        JOIN Business b ON b.business_id = ranked.business_id
+        JOIN Review r ON r.review_id = ranked.best_review_id AND r.business_id = ranked.business_id
+        CROSS JOIN search
+        ORDER BY ranked.relevance DESC, b.business_id
+    """
+
+# Every query the UI runs, by name. Each is prepared once per pooled connection
+# and then run with EXECUTE, so the server only parses and plans it once
+QUERIES = {
+    'data_generation': "SELECT generation FROM DataGeneration",
+    # Every state/city/zipcode combination, for the location index
+    'list_locations': """
+        SELECT DISTINCT state, city, zipcode
+        FROM Business
+        WHERE state IS NOT NULL AND city IS NOT NULL AND zipcode IS NOT NULL
+        ORDER BY state, city, zipcode
+    """,
+    # Unique categories for a given zipcode
+    'list_categories': """
+        SELECT DISTINCT c.name
+        FROM Category c
+        JOIN BusinessCategory bc ON c.category_id = bc.category_id
+        JOIN Business b ON bc.business_id = b.business_id
+        WHERE b.zipcode = $1
+        ORDER BY c.name
+    """,
+    # Review, checkin and category totals come from the BusinessSummary materialized
+    # view. Result lists are keyset-paginated: each page starts after the sort
+    # key of the last row already shown
+    'list_businesses': """
+        SELECT b.name, b.address || ', ' || b.city, b.city, ROUND(b.stars::numeric, 1), s.review_count,
+               COALESCE(ROUND(s.avg_review_stars::numeric, 1), 0) AS average_rating, s.total_checkins,
+               b.business_id
+        FROM Business b
+        JOIN BusinessSummary s ON s.business_id = b.business_id
+        WHERE b.city = $1 AND b.state = $2 AND b.zipcode = $3
+          AND (b.name, b.business_id) > ($4, $5)
+        ORDER BY b.name, b.business_id
+        LIMIT $6
+    """,
+    'list_businesses_category': """
+        SELECT b.name, b.address || ', ' || b.city, b.city, ROUND(b.stars::numeric, 1), s.review_count,
+               COALESCE(ROUND(s.avg_review_stars::numeric, 1), 0) AS average_rating, s.total_checkins,
+               b.business_id
+        FROM Business b
+        JOIN BusinessSummary s ON s.business_id = b.business_id
+        WHERE b.city = $1 AND b.state = $2 AND b.zipcode = $3
+          AND EXISTS (SELECT 1
+                      FROM BusinessCategory bc
+                      JOIN Category c ON bc.category_id = c.category_id
+                      WHERE bc.business_id = b.business_id AND c.name = $4)
+          AND (b.name, b.business_id) > ($5, $6)
+        ORDER BY b.name, b.business_id
+        LIMIT $7
+    """,
+    'count_businesses': """
+        SELECT COUNT(*)
+        FROM Business b
+        JOIN BusinessSummary s ON s.business_id = b.business_id
+        WHERE b.city = $1 AND b.state = $2 AND b.zipcode = $3
+    """,
+    'count_businesses_category': """
+        SELECT COUNT(*)
+        FROM Business b
+        JOIN BusinessSummary s ON s.business_id = b.business_id
+        WHERE b.city = $1 AND b.state = $2 AND b.zipcode = $3
+          AND EXISTS (SELECT 1
+                      FROM BusinessCategory bc
+                      JOIN Category c ON bc.category_id = c.category_id
+                      WHERE bc.business_id = b.business_id AND c.name = $4)
+    """,
+    'list_top_categories': """
+        SELECT c.name, COUNT(*) as business_count
+        FROM Category c
+        JOIN BusinessCategory bc ON c.category_id = bc.category_id
+        JOIN Business b ON bc.business_id = b.business_id
+        WHERE b.zipcode = $1
+        GROUP BY c.name
+        HAVING COUNT(*) >= $2
+        ORDER BY business_count DESC
+    """,
+    'list_zipcode_stats': """
+        SELECT b.zipcode, COUNT(b.business_id) AS num_businesses, zs.medianIncome, zs.meanincome, zs.population
+        FROM Business b
+        LEFT JOIN ZipcodeStats zs ON b.zipcode = zs.zipcode
+        WHERE b.zipcode = $1
+        GROUP BY b.zipcode, zs.medianIncome, zs.meanincome, zs.population
+    """,
+    # Businesses at or above their zipcode's average stars and average checkins,
+    # paged on (total checkins desc, stars desc, business_id)
+    'get_popular_businesses': POPULAR_IN_ZIPCODE + """
+        SELECT name, ROUND(stars::numeric, 2) AS average_stars, total_checkins, business_id
+        FROM popular
+        WHERE (-total_checkins, -ROUND(stars::numeric, 2), business_id) > ($2, $3, $4)
+        ORDER BY total_checkins DESC, average_stars DESC, business_id
+        LIMIT $5
+    """,
+    'count_popular_businesses': POPULAR_IN_ZIPCODE + "SELECT COUNT(*) FROM popular",
+    # The same ranking across every zipcode in a state, each business judged
+    # against its own zipcode's baseline
+    'get_popular_businesses_in_state': """
+        WITH scored AS (
+            SELECT b.business_id, b.name, b.zipcode, b.stars, s.total_checkins,
+                   AVG(b.stars) OVER zipcode AS zipcode_avg_stars,
+                   AVG(s.total_checkins) FILTER (WHERE s.total_checkins > 0) OVER zipcode AS zipcode_avg_checkins
+            FROM Business b
+            JOIN BusinessSummary s ON s.business_id = b.business_id
+            WHERE b.state = $1
+            WINDOW zipcode AS (PARTITION BY b.zipcode)
+        )
+        SELECT name, zipcode, ROUND(stars::numeric, 2) AS average_stars, total_checkins
+        FROM scored
+        WHERE total_checkins > 0
+          AND stars >= zipcode_avg_stars
+          AND total_checkins >= zipcode_avg_checkins
+        ORDER BY total_checkins DESC, average_stars DESC, business_id
+        LIMIT $2
+    """,
+    # Earliest review date and total review and check-in counts, paged on
+    # (start date with no reviews last, review count desc, checkins desc, business_id)
+    'get_successful_businesses': """
+        SELECT
+            b.name,
+            s.first_review_date AS start_date,
+            s.review_count,
+            s.total_checkins AS checkin_count,
+            b.business_id
+        FROM
+            Business b
+        JOIN
+            BusinessSummary s ON s.business_id = b.business_id
+        WHERE
+            b.zipcode = $1
+            AND (COALESCE(s.first_review_date, '9999-12-31'), -s.review_count, -s.total_checkins, b.business_id)
+                > ($2, $3, $4, $5)
+        ORDER BY
+            COALESCE(s.first_review_date, '9999-12-31') ASC, review_count DESC, checkin_count DESC, b.business_id
+        LIMIT $6
+    """,
+    'count_zipcode_businesses': """
+        SELECT COUNT(*)
+        FROM Business b
+        JOIN BusinessSummary s ON s.business_id = b.business_id
+        WHERE b.zipcode = $1
+    """,
+    'search_reviews_zipcode': review_search("b.zipcode = $2", "$3"),
+    'search_reviews_city': review_search("b.city = $2 AND b.state = $3", "$4"),
+    # A business's 168 hourly checkin counts, from CheckInHistogram when it was
+    # loaded that way and folded from its CheckIn rows otherwise
+    'checkin_histogram': """
+        SELECT COALESCE(
+            (SELECT hours FROM CheckInHistogram WHERE business_id = $1),
+            (SELECT array_agg(COALESCE(ci.num_checkins, 0)::int ORDER BY g.slot)
+             FROM generate_series(0, 167) AS g(slot)
+             LEFT JOIN (
+                 SELECT (array_position(ARRAY['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday',
+                                              'Sunday'], day) - 1) * 24 + EXTRACT(HOUR FROM time)::int AS slot,
+                        SUM(num_checkins) AS num_checkins
+                 FROM CheckIn
+                 WHERE business_id = $1
+                 GROUP BY 1
+             ) ci ON ci.slot = g.slot))
+    """,
+}
+
+# A unit of background work. It tracks the connections it is using so that a
+# stale request can be cancelled on the server, not just ignored when it returns
+class QueryTask:
+    def __init__(self):
+        self.cancelled = False
+        self.connections = set()
+        self.lock = threading.Lock()
+
+    def attach(self, conn):
+        with self.lock:
+            if self.cancelled:
+                raise psycopg2.extensions.QueryCanceledError("query cancelled before it started")
+            self.connections.add(conn)
+
+    def detach(self, conn):
+        # Holding the lock means cancel() can never hit a connection that has
+        # already gone back to the pool and is running someone else's query
+        with self.lock:
+            self.connections.discard(conn)
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            for conn in self.connections:
+                try:
+                    conn.cancel()
+                except psycopg2.Error:
+                    pass
+
+current_task = contextvars.ContextVar('current_task', default=None)
+
+def run_query(name, params=(), fetch='all'):
+    task = current_task.get()
+    with get_pool().connection() as conn:
+        if task:
+            task.attach(conn)
+        try:
+            with conn.cursor() as cur:
+                if name not in conn.prepared:
+                    cur.execute(f"PREPARE {name} AS {QUERIES[name]}")
+                    conn.prepared.add(name)
+                if params:
+                    cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+                else:
+                    cur.execute(f"EXECUTE {name}")
+                return cur.fetchone() if fetch == 'one' else cur.fetchall()
+        finally:
+            if task:
+                task.detach(conn)
+
+# DECLARE cannot run a prepared statement, so streamed queries are sent as text
+# with their $n placeholders turned into named parameters
+def named_parameters(query):
+    return re.sub(r'\$(\d+)', r'%(p\1)s', query.replace('%', '%%'))
+
+# Makes the connection cancellable by the task running the current step. A
+# stream is resumed by a different task for each batch it is asked for
+@contextmanager
+def attached(conn):
+    task = current_task.get()
+    if task:
+        task.attach(conn)
+    try:
+        yield
+    finally:
+        if task:
+            task.detach(conn)
+
+# Yields the rows of a query in batches from a named (server-side) cursor; each
+# batch is only fetched when the caller asks for it, so one batch at a time is
+# read however many rows match. The pooled connection is held until the
+# generator is exhausted or closed
+def stream_query(name, params=(), batch_size=STREAM_BATCH_SIZE):
+    with get_pool().connection() as conn:
+        # Server-side cursors only live inside a transaction
+        conn.autocommit = False
+        try:
+            with conn.cursor(name=f'stream_{name}') as cur:
+                with attached(conn):
+                    cur.execute(named_parameters(QUERIES[name]),
+                                {f'p{index}': value for index, value in enumerate(params, start=1)})
+                while True:
+                    with attached(conn):
+                        rows = cur.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield rows
+        finally:
+            if not conn.closed:
+                conn.rollback()
+                conn.autocommit = True
+
+# The server and database the pool connects to, as host/dbname
+def database_name():
+    return f"{DB_SETTINGS['host']}/{DB_SETTINGS['database']}"
+
+# state -> city -> zipcodes, built from a single query and kept on disk stamped
+# with the database and its data generation, so the drill-down listboxes never
+# hit the database. A cache_file of None keeps the index in memory only
+class LocationIndex:
+    def __init__(self, cache_file=LOCATION_CACHE_FILE):
+        self.cache_file = cache_file
+        self.generation = None
+        self.states = {}
+
+    def load(self):
+        generation = run_query('data_generation', fetch='one')[0]
+        if generation == self.generation:
+            return
+        if not self.load_cache(generation):
+            # Built aside and swapped in, since the Tk thread may be reading the old tree
+            states = {}
+            for state, city, zipcode in run_query('list_locations'):
+                states.setdefault(state, {}).setdefault(city, []).append(zipcode)
+            self.states = states
+            self.save_cache(generation)
+        self.generation = generation
+
+    def load_cache(self, generation):
+        if not self.cache_file:
+            return False
+        try:
+            with open(self.cache_file) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return False
+        # Every database starts at generation 0, so the stamp names the database too
+        if cache.get('database') != database_name() or cache.get('generation') != generation:
+            return False
+        self.states = cache['states']
+        return True
+
+    def save_cache(self, generation):
+        if not self.cache_file:
+            return
+        temp_file = self.cache_file + '.tmp'
+        try:
+            with open(temp_file, 'w') as f:
+                json.dump({'database': database_name(), 'generation': generation, 'states': self.states}, f)
+            os.replace(temp_file, self.cache_file)
+        except OSError as error:
+            print(f"Could not write {self.cache_file}: {error}")
+
+locations = LocationIndex()
+
+def load_locations():
+    locations.load()
+    return list_states()
+
+def list_states():
+    return sorted(locations.states)
+
+def list_cities(state):
+    return sorted(locations.states.get(state, {}))
+
+def list_zipcodes(state, city):
+    return locations.states.get(state, {}).get(city, [])
+
+# LRU cache of query results keyed by function and arguments. Entries are
+# stamped with the data generation they were read at, so nothing cached before
+# a reload is ever served after it
+class QueryCache:
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = None
+        self.generation_checked = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def current_generation(self):
+        now = time.monotonic()
+        with self.lock:
+            if now - self.generation_checked < CACHE_GENERATION_CHECK_INTERVAL:
+                return self.generation
+        generation = run_query('data_generation', fetch='one')[0]
+        with self.lock:
+            self.generation_checked = now
+            if generation != self.generation:
+                self.invalidations += len(self.entries)
+                self.entries.clear()
+                self.generation = generation
+        return generation
+
+    def get_or_run(self, key, func, args):
+        generation = self.current_generation()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry:
+                entry_generation, stored_at, result = entry
+                if entry_generation == generation and time.monotonic() - stored_at < self.ttl:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return result
+                del self.entries[key]
+                self.expirations += 1
+            self.misses += 1
+        result = func(*args)
+        with self.lock:
+            self.entries[key] = (generation, time.monotonic(), result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return result
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'generation': self.generation,
+            }
+
+query_cache = QueryCache()
+
+def cached(func):
+    @functools.wraps(func)
+    def wrapper(*args):
+        return query_cache.get_or_run((func.__name__,) + args, func, args)
+    return wrapper
+
+@cached
+def list_categories(zipcode):
+    return run_query('list_categories', (zipcode,))
+
+# Keys that sort before every row, used to fetch the first page
+FIRST_BUSINESS_KEY = ('', '')
+FIRST_POPULAR_KEY = (-2 ** 62, -10, '')
+FIRST_SUCCESSFUL_KEY = ('', -2 ** 62, -2 ** 62, '')
+
+def list_businesses(city, state, zipcode, category=None, after=None, limit=PAGE_SIZE):
+    after = after or FIRST_BUSINESS_KEY
+    # The category filter is a separate prepared statement
+    if category:
+        return run_query('list_businesses_category', (city, state, zipcode, category, *after, limit))
+    return run_query('list_businesses', (city, state, zipcode, *after, limit))
+
+# Every business in a location, streamed in batches; a NULL limit is no limit
+def stream_businesses(city, state, zipcode, batch_size=STREAM_BATCH_SIZE):
+    return stream_query('list_businesses', (city, state, zipcode, *FIRST_BUSINESS_KEY, None), batch_size)
+
+def business_key(business):
+    return (business[0], business[7])
+
+def count_businesses(city, state, zipcode, category=None):
+    if category:
+        return run_query('count_businesses_category', (city, state, zipcode, category), fetch='one')[0]
+    return run_query('count_businesses', (city, state, zipcode), fetch='one')[0]
+
+@cached
+def list_top_categories(zipcode, min_count=5):
+    return run_query('list_top_categories', (zipcode, min_count))
+
+@cached
+def list_zipcode_stats(zipcode):
+    return run_query('list_zipcode_stats', (zipcode,), fetch='one')
+
+@cached
+def get_popular_businesses(zipcode, after=None, limit=PAGE_SIZE):
+    return run_query('get_popular_businesses', (zipcode, *(after or FIRST_POPULAR_KEY), limit))
+
+def popular_key(business):
+    return (-business[2], -business[1], business[3])
+
+@cached
+def count_popular_businesses(zipcode):
+    return run_query('count_popular_businesses', (zipcode,), fetch='one')[0]
+
+@cached
+def get_popular_businesses_in_state(state, limit=50):
+    return run_query('get_popular_businesses_in_state', (state, limit))
+
+@cached
+def get_successful_businesses(zipcode, after=None, limit=PAGE_SIZE):
+    return run_query('get_successful_businesses', (zipcode, *(after or FIRST_SUCCESSFUL_KEY), limit))
+
+def stream_successful_businesses(zipcode, batch_size=STREAM_BATCH_SIZE):
+    return stream_query('get_successful_businesses', (zipcode, *FIRST_SUCCESSFUL_KEY, None), batch_size)
+
+def successful_key(business):
+    return (business[1] or '9999-12-31', -business[2], -business[3], business[4])
+
+@cached
+def count_zipcode_businesses(zipcode):
+    return run_query('count_zipcode_businesses', (zipcode,), fetch='one')[0]
+
+# Review search within a zipcode, or the whole city when no zipcode is given
+@cached
+def search_reviews(text, state, city, zipcode=None, limit=SEARCH_LIMIT):
+    if zipcode:
+        return run_query('search_reviews_zipcode', (text, zipcode, limit))
+    return run_query('search_reviews_city', (text, city, state, limit))
+
+@cached
+def get_checkin_histogram(business_id):
+    return run_query('checkin_histogram', (business_id,), fetch='one')[0]
+
+def checkin_total(hours):
+    return sum(hours)
+
+# (day, hour, checkins) of the busiest slot, or None without checkins
+def busiest_hour(hours):
+    slot = max(range(len(hours)), key=hours.__getitem__)
+    if not hours[slot]:
+        return None
+    return DAYS[slot // 24], slot % 24, hours[slot]
+
+# day -> its 24 hourly counts, in DAYS order
+def checkin_heatmap(hours):
+    return {day: hours[index * 24:(index + 1) * 24] for index, day in enumerate(DAYS)}
+
+def checkins_by_day(hours):
+    return {day: sum(counts) for day, counts in checkin_heatmap(hours).items()}
+
+def get_checkin_heatmap(business_id):
+    hours = get_checkin_histogram(business_id)
+    return {
+        'heatmap': checkin_heatmap(hours),
+        'by_day': checkins_by_day(hours),
+        'total': checkin_total(hours),
+        'busiest': busiest_hour(hours),
+    }
+
+# asyncio API over the same pool and cache. Each query runs on a worker thread
+# with asyncio.to_thread, which copies the caller's context, so the QueryTask in
+# current_task is attached to every connection involved and cancelling the
+# awaiting coroutine cancels the statements on the server too.
+# This is deliberately not an async driver pool: psycopg2 has none, a second
+# driver would need its own prepared statements, cache and instrumentation, and
+# the UI enters through blocking(), where each call runs its own event loop that
+# a loop-bound async pool could not be shared across. Up to POOL_MAX_CONNECTIONS
+# queries run at once, each on a kept-open connection with its statements prepared
+async def gather_queries(*calls):
+    task = current_task.get() or QueryTask()
+    token = current_task.set(task)
+    try:
+        return await asyncio.gather(*(asyncio.to_thread(func, *args) for func, *args in calls))
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        current_task.reset(token)
+
+# The three zipcode panels, so a click costs the slowest lookup rather than the sum
+async def zipcode_overview(zipcode, min_count=5):
+    stats, categories, top_categories = await gather_queries(
+        (list_zipcode_stats, zipcode),
+        (list_categories, zipcode),
+        (list_top_categories, zipcode, min_count))
+    return {'stats': stats, 'categories': categories, 'top_categories': top_categories}
+
+# First pages and totals of the popular and successful business listings
+async def business_views(zipcode):
+    popular, popular_count, successful, successful_count = await gather_queries(
+        (get_popular_businesses, zipcode),
+        (count_popular_businesses, zipcode),
+        (get_successful_businesses, zipcode),
+        (count_zipcode_businesses, zipcode))
+    return {
+        'popular': popular,
+        'popular_count': popular_count,
+        'successful': successful,
+        'successful_count': successful_count,
+    }
+
+# Wraps a coroutine function for callers on a plain worker thread, such as the
+# Tk UI's QueryRunner. asyncio.run copies the thread's context into its main task
+def blocking(coroutine_function):
+    @functools.wraps(coroutine_function)
+    def wrapper(*args):
+        return asyncio.run(coroutine_function(*args))
+    return wrapper
+
+async def describe_zipcode(zipcode):
+    started = time.perf_counter()
+    overview, views = await asyncio.gather(zipcode_overview(zipcode), business_views(zipcode))
+    return dict(overview, **views, seconds=time.perf_counter() - started)
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the UI's zipcode panels as JSON, without a window")
+    parser.add_argument('zipcode', nargs='+', help="zipcodes to look up")
+    parser.add_argument('--database', default=DB_SETTINGS['database'], help="database to query")
+    args = parser.parse_args()
+
+    DB_SETTINGS['database'] = args.database
+    for zipcode in args.zipcode:
+        print(json.dumps({zipcode: asyncio.run(describe_zipcode(zipcode))}, default=str, indent=2))
+
+if __name__ == "__main__":
+    main()
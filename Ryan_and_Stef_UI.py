@@ -1,125 +1,117 @@
+import time
+# Taken before the other imports, so --profile-startup can report their cost
+STARTED = time.perf_counter()
+import argparse
+import functools
+import json
+import queue
+import threading
 import tkinter as tk
+import tkinter.messagebox
+from concurrent.futures import ThreadPoolExecutor
 from tkinter import ttk
-import psycopg2
-from scipy import stats
-
-def connect_to_db():
-    try:
-        conn = psycopg2.connect(
-            host="localhost",
-            database="milestone3db",
-            user="postgres",
-            password="ramram69")
-        return conn
-    except (Exception, psycopg2.DatabaseError) as error:
-        print(error)
-
-def list_states():
-    conn = connect_to_db()
-    cur = conn.cursor()
-    cur.execute("SELECT DISTINCT state FROM Business ORDER BY state;")
-    states = cur.fetchall()
-    cur.close()
-    conn.close()
-    return states
-
-def list_cities(state):
-    conn = connect_to_db()
-    cur = conn.cursor()
-    cur.execute("SELECT DISTINCT city FROM Business WHERE state = %s ORDER BY city;", (state,))
-    cities = cur.fetchall()
-    cur.close()
-    conn.close()
-    return cities
-
-def list_zipcodes(city):
-    conn = connect_to_db()
-    cur = conn.cursor()
-    cur.execute("SELECT DISTINCT zipcode FROM Business WHERE city = %s ORDER BY zipcode;", (city,))
-    zipcodes = cur.fetchall()
-    cur.close()
-    conn.close()
-    return zipcodes
-
-def list_categories(zipcode):
-    conn = connect_to_db()
-    cur = conn.cursor()
-    # This query has been updated to correctly join and fetch unique categories for a given zipcode
-    cur.execute("""
-        SELECT DISTINCT c.name 
-        FROM Category c
-        JOIN BusinessCategory bc ON c.category_id = bc.category_id
-        JOIN Business b ON bc.business_id = b.business_id
-        WHERE b.zipcode = %s
-        ORDER BY c.name;
-    """, (zipcode,))
-    categories = cur.fetchall()
-    cur.close()
-    conn.close()
-    return categories
-
-def list_businesses(city, state, zipcode, category=None):
-    conn = connect_to_db()
-    cur = conn.cursor()
-    # The SQL query needs to handle an optional category filter
-    query = """
-        SELECT b.name, b.address || ', ' || b.city, b.city, ROUND(b.stars::numeric, 1), COUNT(r.review_id), 
-               COALESCE(ROUND(AVG(r.stars)::numeric, 1), 0) AS average_rating, COALESCE(SUM(ci.num_checkins), 0)
-        FROM Business b
-        LEFT JOIN Review r ON b.business_id = r.business_id
-        LEFT JOIN CheckIn ci ON b.business_id = ci.business_id
-        LEFT JOIN BusinessCategory bc ON b.business_id = bc.business_id
-        LEFT JOIN Category c ON bc.category_id = c.category_id
-        WHERE b.city = %s AND b.state = %s AND b.zipcode = %s
-    """
-    params = [city, state, zipcode]
-    
-    if category:
-        query += " AND c.name = %s"
-        params.append(category)
-        
-    query += " GROUP BY b.business_id ORDER BY b.name;"
-    cur.execute(query, params)
-    businesses = cur.fetchall()
-    cur.close()
-    conn.close()
-    return businesses
-
-
-def list_top_categories(zipcode, min_count=5):
-    conn = connect_to_db()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT c.name, COUNT(*) as business_count
-        FROM Category c
-        JOIN BusinessCategory bc ON c.category_id = bc.category_id
-        JOIN Business b ON bc.business_id = b.business_id
-        WHERE b.zipcode = %s
-        GROUP BY c.name
-        HAVING COUNT(*) >= %s
-        ORDER BY business_count DESC;
-    """, (zipcode, min_count))
-    top_categories = cur.fetchall()
-    cur.close()
-    conn.close()
-    return top_categories
-
-def list_zipcode_stats(zipcode):
-    conn = connect_to_db()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT b.zipcode, COUNT(b.business_id) AS num_businesses, zs.medianIncome, zs.meanincome, zs.population
-        FROM Business b
-        LEFT JOIN ZipcodeStats zs ON b.zipcode = zs.zipcode
-        WHERE b.zipcode = %s
-        GROUP BY b.zipcode, zs.medianIncome, zs.meanincome, zs.population;
-    """, (zipcode,))
-    stats = cur.fetchone()
-    cur.close()
-    conn.close()
-    return stats
+import psycopg2.extensions
+import Ryan_and_Stef_instrument as instrument
+import Ryan_and_Stef_Service as service
+
+QUERY_WORKERS = 4
+# How often the Tk main loop picks up finished queries, in milliseconds
+RESULT_POLL_INTERVAL = 20
+
+# Where the location drill-down, zipcode panels and business search read from:
+# the live database, or a snapshot file opened with --snapshot
+source = service
+
+# Milliseconds from the start of the imports to each startup milestone: imports
+# done, window built, first paint and first data (the state list)
+class StartupProfile:
+    def __init__(self, started):
+        self.started = started
+        self.marks = {}
+        self.enabled = False
+        self.finished = False
+
+    def mark(self, name):
+        if name not in self.marks:
+            self.marks[name] = (time.perf_counter() - self.started) * 1000
+
+    # True the first time only; later state reloads are not part of startup
+    def finish(self):
+        if self.finished:
+            return False
+        self.finished = True
+        if self.enabled:
+            print(f"Startup profile: {json.dumps({name: round(ms, 1) for name, ms in self.marks.items()})}",
+                  flush=True)
+        return True
+
+startup = StartupProfile(STARTED)
+startup.mark('imports')
+
+# Runs query functions on a thread pool and hands results back to the Tk main
+# loop, which polls for them with root.after. Each request belongs to a channel
+# (one per panel); a new request on a channel cancels the one in flight
+class QueryRunner:
+    def __init__(self, root, workers=QUERY_WORKERS):
+        self.root = root
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.results = queue.Queue()
+        self.tasks = {}
+        self.root.after(RESULT_POLL_INTERVAL, self.poll)
+
+    def submit(self, channel, func, on_done, *args, on_error=None):
+        self.cancel(channel)
+        task = service.QueryTask()
+        self.tasks[channel] = task
+        self.executor.submit(self.run, channel, task, func, args, (on_done, on_error))
+
+    def cancel(self, *channels):
+        for channel in channels:
+            task = self.tasks.pop(channel, None)
+            if task:
+                task.cancel()
+
+    def shutdown(self):
+        self.cancel(*list(self.tasks))
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, channel, task, func, args, callbacks):
+        token = service.current_task.set(task)
+        try:
+            result, error = func(*args), None
+        except psycopg2.extensions.QueryCanceledError as e:
+            # Requests cancelled here are dropped; a cancel from the server
+            # (statement_timeout, an administrator) is reported like any error
+            if task.cancelled:
+                return
+            result, error = None, e
+        except Exception as e:
+            result, error = None, e
+        finally:
+            service.current_task.reset(token)
+        self.results.put((channel, task, callbacks, result, error))
+
+    def poll(self):
+        while True:
+            try:
+                channel, task, (on_done, on_error), result, error = self.results.get_nowait()
+            except queue.Empty:
+                break
+            # Drop results for requests that were superseded while running
+            if self.tasks.get(channel) is not task:
+                continue
+            del self.tasks[channel]
+            if error:
+                print(f"Query for {channel} failed: {error}")
+                if on_error:
+                    on_error(error)
+            else:
+                on_done(result)
+        self.root.after(RESULT_POLL_INTERVAL, self.poll)
 
 def clear_all():
+    # Clear the treeviews and anything still loading for them
+    clear_zipcode_panels()
     # Clear listboxes
     state_listbox.delete(0, tk.END)
     city_listbox.delete(0, tk.END)
@@ -127,140 +119,251 @@ def clear_all():
     category_listbox.delete(0, tk.END)
     top_categories_listbox.delete(0, tk.END)
     
-    # Clear the treeview
-    business_treeview.delete(*business_treeview.get_children())
-    
-    # Optionally, you can re-populate the state listbox if needed
-    for state in list_states():
-        state_listbox.insert(tk.END, state[0])
-
-def get_popular_businesses(zipcode):
-    conn = connect_to_db()
-    cur = conn.cursor()
-    # Make sure to replace placeholders with actual variable where necessary.
-    cur.execute("""
-        SELECT 
-        b.name,
-        ROUND(AVG(b.stars)::numeric, 2) AS average_stars,
-        SUM(ci.num_checkins) AS total_checkins
-    FROM 
-        Business b
-    JOIN 
-        BusinessCategory bc ON b.business_id = bc.business_id
-    JOIN 
-        Category c ON bc.category_id = c.category_id
-    JOIN 
-        CheckIn ci ON b.business_id = ci.business_id
-    WHERE
-        b.zipcode = %s
-    GROUP BY 
-        b.business_id
-    HAVING 
-        AVG(b.stars) >= (SELECT AVG(b2.stars) 
-                        FROM Business b2
-                        WHERE b2.zipcode = b.zipcode)
-        AND 
-        SUM(ci.num_checkins) >= (SELECT AVG(ci2.total_checkins)
-                                FROM (SELECT b2.business_id, SUM(ci2.num_checkins) AS total_checkins
-                                    FROM Business b2
-                                    JOIN CheckIn ci2 ON b2.business_id = ci2.business_id
-                                    WHERE b2.zipcode = b.zipcode
-                                    GROUP BY b2.business_id) AS ci2)
-    ORDER BY 
-        total_checkins DESC, average_stars DESC;
-    """, [zipcode])
-    popular_businesses = cur.fetchall()
-    cur.close()
-    conn.close()
-    return popular_businesses
+    # Re-populate the state listbox, reloading the location index if the data changed
+    load_states()
+
+# The state list loads in the background, so the window paints even while the
+# database is slow or down
+def load_states(snapshot_path=None):
+    status_label.config(text="Loading states...")
+    runner.submit('states', read_states, fill_states, snapshot_path, on_error=show_states_error)
+
+def read_states(snapshot_path):
+    global source
+    if snapshot_path and source is service:
+        # numpy is only imported, off the Tk thread, for snapshot browsing
+        import Ryan_and_Stef_snapshot
+        source = Ryan_and_Stef_snapshot.Snapshot(snapshot_path)
+    return source.load_locations()
+
+def fill_states(states):
+    state_listbox.delete(0, tk.END)
+    for state in states:
+        state_listbox.insert(tk.END, state)
+    status_label.config(text="")
+    startup.mark('first_data')
+    finish_startup()
+
+def show_states_error(error):
+    status_label.config(text=f"Could not load states: {error}")
+    startup.mark('first_data_failed')
+    finish_startup()
+
+def finish_startup():
+    if startup.finish() and exit_after_startup:
+        root.after(0, root.destroy)
 
 # Function to update the popular businesses treeview
 def update_popular_businesses(zipcode):
-    # Clear the treeview
-    for i in popular_businesses_treeview.get_children():
-        popular_businesses_treeview.delete(i)
-    # Run the query to get popular businesses
-    popular_businesses = get_popular_businesses(zipcode)
-    # Insert the results into the treeview
-    for business in popular_businesses:
-        popular_businesses_treeview.insert('', 'end', values=(business[0], business[1], business[2]))
-
-def get_successful_businesses(zipcode):
-    conn = connect_to_db()
-    cur = conn.cursor()
-    # Adjust the SQL to calculate the earliest review date and total review and check-in counts
-    cur.execute("""
-        SELECT
-            b.name,
-            MIN(r.date) AS start_date,
-            COUNT(DISTINCT r.review_id) as review_count,
-            SUM(ci.num_checkins) as checkin_count
-        FROM
-            Business b
-            LEFT JOIN Review r ON b.business_id = r.business_id
-            LEFT JOIN CheckIn ci ON b.business_id = ci.business_id
-        WHERE
-            b.zipcode = %s
-        GROUP BY
-            b.business_id
-        ORDER BY
-            start_date ASC, review_count DESC, checkin_count DESC;
-    """, (zipcode,))
-    successful_businesses = cur.fetchall()
-    cur.close()
-    conn.close()
-    return successful_businesses
-
-# Function to update the successful businesses treeview
-def update_successful_businesses(zipcode):
-    # Clear the treeview
-    for i in successful_businesses_treeview.get_children():
-        successful_businesses_treeview.delete(i)
-    # Run the query to get successful businesses
-    successful_businesses = get_successful_businesses(zipcode)
-    # Insert the results into the treeview
-    for business in successful_businesses:
-        successful_businesses_treeview.insert('', 'end', values=(business[0], business[1], business[2], business[3]))
+    popular_pager.load(functools.partial(service.get_popular_businesses, zipcode), format_popular_business,
+                       service.popular_key, functools.partial(service.count_popular_businesses, zipcode))
 
+def format_popular_business(business):
+    return (business[0], business[1], business[2])
 
+# Top popular businesses across every zipcode of the selected state
+def update_state_popular_businesses():
+    if not state_listbox.curselection():
+        tk.messagebox.showinfo("Selection Error", "Please select a state.")
+        return
+    selected_state = state_listbox.get(state_listbox.curselection())
+    # A single top-N page, so there is no row key to continue from
+    popular_pager.load(lambda after: service.get_popular_businesses_in_state(selected_state, 50),
+                       format_state_popular_business)
 
+def format_state_popular_business(business):
+    name, zipcode, stars, checkins = business
+    return (f"{name} ({zipcode})", stars, checkins)
 
+# Function to update the successful businesses treeview
+def update_successful_businesses(zipcode):
+    successful_pager.stream(functools.partial(service.stream_successful_businesses, zipcode),
+                            format_successful_business, functools.partial(service.count_zipcode_businesses, zipcode))
+
+def format_successful_business(business):
+    return (business[0], business[1], business[2], business[3])
+
+# A generator of row batches read from the query threads one batch per
+# request. The lock keeps a close from running while a batch is being read
+class BatchStream:
+    def __init__(self, batches):
+        self.batches = batches
+        self.lock = threading.Lock()
+
+    # Takes the ignored keyset position, so it can stand in for a page function
+    def next_batch(self, after=None):
+        with self.lock:
+            return next(self.batches, [])
+
+    def close(self):
+        with self.lock:
+            self.batches.close()
+
+# Treeview that fetches one keyset page at a time: the first page on load and
+# the next one whenever the view is scrolled near the bottom, so the time to
+# the first row does not depend on how many rows match. Broad listings are
+# streamed instead, one batch of a server-side cursor per page, so the rows
+# read still follow the scrolling
+class PagedTreeview:
+    def __init__(self, treeview, scrollbar, count_label, channel):
+        self.treeview = treeview
+        self.scrollbar = scrollbar
+        self.count_label = count_label
+        self.channel = channel
+        self.fetch_page = None
+        self.format_row = None
+        self.row_key = None
+        self.row_id = None
+        self.batches = None
+        self.reset()
+        treeview.configure(yscrollcommand=self.on_scroll)
+        scrollbar.config(command=treeview.yview)
+
+    def reset(self):
+        self.after = None
+        self.loading = False
+        self.exhausted = True
+        self.shown = 0
+        self.total = None
+
+    def clear(self):
+        runner.cancel(self.channel, self.channel + '_count')
+        self.close_stream()
+        self.reset()
+        self.treeview.delete(*self.treeview.get_children())
+        self.count_label.config(text="")
+
+    # row_id, when given, names each treeview item, so a selection can be traced
+    # back to its row
+    def load(self, fetch_page, format_row, row_key=None, count=None, row_id=None):
+        self.clear()
+        self.start(fetch_page, format_row, row_key, count, row_id)
+
+    # open_stream returns a generator of row batches; nothing is read until
+    # the first page is asked for
+    def stream(self, open_stream, format_row, count=None, row_id=None):
+        self.clear()
+        self.batches = BatchStream(open_stream())
+        self.start(self.batches.next_batch, format_row, None, count, row_id)
+
+    def start(self, fetch_page, format_row, row_key, count, row_id):
+        self.fetch_page = fetch_page
+        self.format_row = format_row
+        self.row_key = row_key
+        self.row_id = row_id
+        self.exhausted = False
+        self.next_page()
+        if count:
+            runner.submit(self.channel + '_count', count, self.set_total)
+
+    # Rolling back the cursor's transaction is a round trip, so it runs on a
+    # query thread
+    def close_stream(self):
+        if self.batches:
+            runner.executor.submit(self.batches.close)
+            self.batches = None
+
+    def next_page(self):
+        if self.loading or self.exhausted:
+            return
+        self.loading = True
+        runner.submit(self.channel, self.fetch_page, self.add_page, self.after, on_error=self.show_error)
+
+    # A failed page leaves the rows already shown; scrolling to the bottom again
+    # retries it. A failed stream cannot be resumed, so it stops where it failed
+    def show_error(self, error):
+        self.loading = False
+        if self.batches:
+            self.exhausted = True
+            self.close_stream()
+        self.count_label.config(text=f"Showing {self.shown}; could not load more: {error}")
+
+    def add_page(self, rows):
+        self.loading = False
+        if self.batches:
+            if len(rows) < service.STREAM_BATCH_SIZE:
+                self.exhausted = True
+                self.close_stream()
+        elif self.row_key is None or len(rows) < service.PAGE_SIZE:
+            self.exhausted = True
+        else:
+            self.after = self.row_key(rows[-1])
+        for row in rows:
+            if self.row_id:
+                self.treeview.insert('', 'end', iid=self.row_id(row), values=self.format_row(row))
+            else:
+                self.treeview.insert('', 'end', values=self.format_row(row))
+        self.shown += len(rows)
+        self.update_count()
+
+    def set_total(self, total):
+        self.total = total
+        self.update_count()
+
+    def update_count(self):
+        total = self.total if self.total is not None else ("?" if not self.exhausted else self.shown)
+        self.count_label.config(text=f"Showing {self.shown} of {total}")
+
+    def on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        if float(last) > 0.9:
+            self.next_page()
+
+# Panels that depend on the selected zipcode; all are cancelled when it changes
+ZIPCODE_CHANNELS = ('zipcode', 'analytics')
+
+def clear_zipcode_panels():
+    runner.cancel(*ZIPCODE_CHANNELS)
+    analytics_treeview.delete(*analytics_treeview.get_children())
+    for pager in (business_pager, popular_pager, successful_pager):
+        pager.clear()
 
 def on_state_selected(event):
     if not state_listbox.curselection():
         return
     selected_state = state_listbox.get(state_listbox.curselection())
-    cities = list_cities(selected_state)
+    clear_zipcode_panels()
     city_listbox.delete(0, tk.END)
     zipcode_listbox.delete(0, tk.END)
     category_listbox.delete(0, tk.END)
-    business_treeview.delete(*business_treeview.get_children())
-    for city in cities:
-        city_listbox.insert(tk.END, city[0])
+    for city in source.list_cities(selected_state):
+        city_listbox.insert(tk.END, city)
 
 def on_city_selected(event):
-    if not city_listbox.curselection():
+    if not city_listbox.curselection() or not state_listbox.curselection():
         return
     selected_city = city_listbox.get(city_listbox.curselection())
-    zipcodes = list_zipcodes(selected_city)
+    selected_state = state_listbox.get(state_listbox.curselection())
+    clear_zipcode_panels()
     zipcode_listbox.delete(0, tk.END)
     category_listbox.delete(0, tk.END)
-    business_treeview.delete(*business_treeview.get_children())
-    for zipcode in zipcodes:
-        zipcode_listbox.insert(tk.END, zipcode[0])
+    # Zipcodes are looked up by state and city, so same-named cities in other states don't mix
+    for zipcode in source.list_zipcodes(selected_state, selected_city):
+        zipcode_listbox.insert(tk.END, zipcode)
 
 def on_zipcode_selected(event):
     # Clear previous selections and entries in listboxes and treeview
     category_listbox.delete(0, tk.END)
     top_categories_listbox.delete(0, tk.END)
-    business_treeview.delete(*business_treeview.get_children())
 
     # Get the currently selected zipcode
     selected_index = zipcode_listbox.curselection()
     if not selected_index:
         return
     selected_zipcode = zipcode_listbox.get(selected_index)
-    stats = list_zipcode_stats(selected_zipcode)
+    # Anything still running for the previous zipcode is cancelled on the server
+    clear_zipcode_panels()
+    # Stats, categories and top categories are looked up concurrently and shown together
+    runner.submit('zipcode', service.blocking(source.zipcode_overview), show_zipcode_overview, selected_zipcode)
+    # Compared against every other zipcode; the first selection runs the bulk query
+    runner.submit('analytics', zipcode_analytics_report, show_zipcode_analytics, selected_zipcode)
+
+def show_zipcode_overview(overview):
+    show_zipcode_stats(overview['stats'])
+    fill_categories(overview['categories'])
+    fill_top_categories(overview['top_categories'])
+
+def show_zipcode_stats(stats):
     if stats:
         num_businesses, population, avg_income = stats[1], stats[4], stats[3]
         num_businesses_label.config(text=f"Number of Businesses: {num_businesses}")
@@ -270,13 +373,39 @@ def on_zipcode_selected(event):
         num_businesses_label.config(text="Number of Businesses: N/A")
         population_label.config(text="Total Population: N/A")
         avg_income_label.config(text="Average Income: N/A")
-    # Update categories for the selected zipcode
-    categories = list_categories(selected_zipcode)
+
+def format_measure(value, spec, suffix=""):
+    return "N/A" if value is None else f"{value:{spec}}{suffix}"
+
+def zipcode_analytics_report(zipcode):
+    # numpy and scipy are imported on the first selection, not at startup
+    import Ryan_and_Stef_analytics
+    return Ryan_and_Stef_analytics.zipcode_report(zipcode)
+
+def show_zipcode_analytics(result):
+    report, correlations = result
+    analytics_treeview.delete(*analytics_treeview.get_children())
+    if report is None:
+        return
+    rows = [
+        ("Businesses per 1,000 residents", format_measure(report['density'], '.2f')),
+        ("Density percentile", format_measure(report['density_percentile'], '.0f')),
+        ("Median income percentile", format_measure(report['income_percentile'], '.0f')),
+        ("Check-ins per business", format_measure(report['checkins_per_business'], '.1f')),
+    ]
+    rows += [(f"More {entry['category']}", f"{entry['ratio']:.2f}x") for entry in report['over_represented']]
+    rows += [(f"Fewer {entry['category']}", f"{entry['ratio']:.2f}x") for entry in report['under_represented']]
+    # Across all zipcodes, for context
+    rows += [(f"Corr. {correlation['x']} / {correlation['y']}", f"{correlation['spearman']:+.2f}")
+             for correlation in correlations if correlation['x'] == 'median_income']
+    for row in rows:
+        analytics_treeview.insert('', 'end', values=row)
+
+def fill_categories(categories):
     for category in categories:
         category_listbox.insert(tk.END, category[0])
 
-    # Fetch top categories for the selected zipcode
-    top_categories = list_top_categories(selected_zipcode, min_count=5)
+def fill_top_categories(top_categories):
     for category, count in top_categories:
         category_str = f"{count} - {category}"  # Format: "count - category name"
         top_categories_listbox.insert(tk.END, category_str)
@@ -296,20 +425,7 @@ def on_category_selected(event):
         selected_zipcode = zipcode_listbox.get(selected_zipcode_idx)
         
         # Fetch businesses based on the selections, with the category filter applied
-        businesses = list_businesses(selected_city, selected_state, selected_zipcode, selected_category)
-        business_treeview.delete(*business_treeview.get_children())
-        
-        # Insert each business into the TreeView
-        for business in businesses:
-            # Format data as needed before insertion into the TreeView
-            formatted_business = (business[0], 
-                                  business[1], 
-                                  business[2], 
-                                  f"{business[3]:.1f}",  # Stars rounded to one decimal place
-                                  business[4],            # Review count
-                                  f"{business[5]:.1f}" if business[5] else "N/A",  # Average rating, check for None
-                                  business[6])            # Number of check-ins
-            business_treeview.insert('', 'end', values=formatted_business)
+        show_businesses(selected_city, selected_state, selected_zipcode, selected_category)
 
 
 def on_search_clicked():
@@ -330,36 +446,90 @@ def on_search_clicked():
     selected_zipcode = zipcode_listbox.get(selected_zipcode_idx)
 
     # Fetch businesses based on the selections, possibly with a category filter applied
-    businesses = list_businesses(selected_city, selected_state, selected_zipcode, selected_category)
-    business_treeview.delete(*business_treeview.get_children())
-    
-    # Insert each business into the TreeView
-    for business in businesses:
-        # Format data as needed before insertion into the TreeView
-        formatted_business = (business[0], 
-                              business[1], 
-                              business[2], 
-                              f"{business[3]:.1f}",  # Stars rounded to one decimal place
-                              business[4],            # Review count
-                              f"{business[5]:.1f}" if business[5] else "N/A",  # Average rating, check for None
-                              business[6])            # Number of check-ins
-        business_treeview.insert('', 'end', values=formatted_business)
+    show_businesses(selected_city, selected_state, selected_zipcode, selected_category)
+
+# Businesses in the selected zipcode (or city, when no zipcode is selected)
+# whose reviews match the search text, best matches first
+def on_review_search_clicked(event=None):
+    text = review_search_entry.get().strip()
+    if not text:
+        return
+    if not state_listbox.curselection() or not city_listbox.curselection():
+        tk.messagebox.showinfo("Selection Error", "Please select a state and city to search reviews in.")
+        return
+    selected_state = state_listbox.get(state_listbox.curselection())
+    selected_city = city_listbox.get(city_listbox.curselection())
+    selected_zipcode = zipcode_listbox.get(zipcode_listbox.curselection()) if zipcode_listbox.curselection() else None
+    review_matches_treeview.delete(*review_matches_treeview.get_children())
+    runner.submit('review_search', service.search_reviews, show_review_matches,
+                  text, selected_state, selected_city, selected_zipcode)
+
+def show_review_matches(matches):
+    review_matches_treeview.delete(*review_matches_treeview.get_children())
+    for name, address, matching_reviews, relevance, snippet, business_id in matches:
+        review_matches_treeview.insert('', 'end', values=(name, matching_reviews, ' '.join(snippet.split())))
+
+def show_businesses(city, state, zipcode, category):
+    count = functools.partial(source.count_businesses, city, state, zipcode, category)
+    # Every business in the location can be a long list, so it is read from one
+    # server-side cursor a batch per page; the category filter narrows it
+    # enough for the prepared, paged query
+    if category is None:
+        business_pager.stream(functools.partial(source.stream_businesses, city, state, zipcode), format_business,
+                              count, business_id)
+    else:
+        business_pager.load(functools.partial(source.list_businesses, city, state, zipcode, category),
+                            format_business, service.business_key, count, business_id)
+
+def business_id(business):
+    return business[7]
+
+def on_business_selected(event):
+    selection = business_treeview.selection()
+    if not selection:
+        return
+    name = business_treeview.item(selection[0], 'values')[0]
+    runner.submit('heatmap', service.get_checkin_heatmap, lambda heatmap: show_checkin_heatmap(name, heatmap),
+                  selection[0])
+
+# Day-of-week by hour grid of a business's checkins, shaded relative to its busiest hour
+def show_checkin_heatmap(name, heatmap):
+    window = tk.Toplevel(root)
+    window.title(f"Check-ins: {name}")
+    cell, margin = 24, 90
+    canvas = tk.Canvas(window, width=margin + 24 * cell + 10, height=cell * (len(heatmap['heatmap']) + 2) + 10,
+                       background='white')
+    canvas.pack(fill=tk.BOTH, expand=True)
+    peak = max((max(counts) for counts in heatmap['heatmap'].values()), default=0) or 1
+    for hour in range(0, 24, 3):
+        canvas.create_text(margin + hour * cell + cell / 2, cell / 2, text=str(hour))
+    for row, (day, counts) in enumerate(heatmap['heatmap'].items(), start=1):
+        canvas.create_text(5, row * cell + cell / 2, text=f"{day} ({heatmap['by_day'][day]})", anchor='w')
+        for hour, count in enumerate(counts):
+            shade = 255 - int(200 * count / peak)
+            x, y = margin + hour * cell, row * cell
+            canvas.create_rectangle(x, y, x + cell, y + cell, fill=f"#ff{shade:02x}{shade:02x}", outline='#dddddd')
+    busiest = heatmap['busiest']
+    summary = f"Total: {heatmap['total']}"
+    if busiest:
+        summary += f"   Busiest: {busiest[0]} {busiest[1]}:00 ({busiest[2]})"
+    canvas.create_text(5, cell * (len(heatmap['heatmap']) + 1) + cell / 2, text=summary, anchor='w')
+
+def format_business(business):
+    # Format data as needed before insertion into the TreeView
+    return (business[0], 
+            business[1], 
+            business[2], 
+            f"{business[3]:.1f}",  # Stars rounded to one decimal place
+            business[4],            # Review count
+            f"{business[5]:.1f}" if business[5] else "N/A",  # Average rating, check for None
+            business[6])            # Number of check-ins
 
 # Function to update both popular and successful businesses treeview
 def update_business_views(zipcode):
-    # Clear the treeviews
-    popular_businesses_treeview.delete(*popular_businesses_treeview.get_children())
-    successful_businesses_treeview.delete(*successful_businesses_treeview.get_children())
-    
-    # Run the queries to get popular and successful businesses
-    popular_businesses = get_popular_businesses(zipcode)
-    successful_businesses = get_successful_businesses(zipcode)
-    
-    # Insert the results into the treeviews
-    for business in popular_businesses:
-        popular_businesses_treeview.insert('', 'end', values=(business[0], business[1], business[2]))
-    for business in successful_businesses:
-        successful_businesses_treeview.insert('', 'end', values=(business[0], business[1], business[2], business[3]))
+    # Each pager fetches its first page and its total concurrently on the worker pool
+    update_popular_businesses(zipcode)
+    update_successful_businesses(zipcode)
 
 
 
@@ -367,170 +537,252 @@ def update_business_views(zipcode):
 
     
 
-# Set up the main window
-root = tk.Tk()
-root.title("Milestone 1 - page1")
-
-# Create a label for the header 'State/City'
-header_label = ttk.Label(root, text="State/City")
-header_label.grid(row=0, column=0, padx=10, pady=5)
-
-# Set up the state listbox with a label
-state_frame = tk.Frame(root)
-state_frame.grid(row=0, column=0, sticky='nwes', padx=10)
-state_label = ttk.Label(state_frame, text="State")
-state_label.pack(side=tk.TOP, fill=tk.X)
-state_scrollbar = ttk.Scrollbar(state_frame, orient=tk.VERTICAL)
-state_listbox = tk.Listbox(state_frame, height=10, yscrollcommand=state_scrollbar.set, exportselection=0)
-state_scrollbar.config(command=state_listbox.yview)
-state_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-state_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-state_listbox.bind("<<ListboxSelect>>", on_state_selected)
-
-# Set up the city listbox with a label
-city_frame = tk.Frame(root)
-city_frame.grid(row=1, column=0, sticky='nwes', padx=10)
-city_label = ttk.Label(city_frame, text="City")
-city_label.pack(side=tk.TOP, fill=tk.X)
-city_scrollbar = ttk.Scrollbar(city_frame, orient=tk.VERTICAL)
-city_listbox = tk.Listbox(city_frame, yscrollcommand=city_scrollbar.set, exportselection=0)
-city_scrollbar.config(command=city_listbox.yview)
-city_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-city_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-city_listbox.bind("<<ListboxSelect>>", on_city_selected)
-            
-# Set up the zipcode with a label
-zipcode_frame = tk.Frame(root)
-zipcode_frame.grid(row=3, column=0, sticky='nwes', padx=10)
-zipcode_label = ttk.Label(zipcode_frame, text="Zipcode")
-zipcode_label.pack(side=tk.TOP, fill=tk.X)
-zipcode_scrollbar = ttk.Scrollbar(zipcode_frame, orient=tk.VERTICAL)
-zipcode_listbox = tk.Listbox(zipcode_frame, yscrollcommand=zipcode_scrollbar.set, exportselection=0)
-zipcode_scrollbar.config(command=zipcode_listbox.yview)
-zipcode_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-zipcode_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-zipcode_listbox.bind("<<ListboxSelect>>", on_zipcode_selected)
-
-# Set up the category with a label
-category_frame = tk.Frame(root)
-category_frame.grid(row=4, column=0, sticky='nwes', padx=10)
-category_label = ttk.Label(category_frame, text="Category")
-category_label.pack(side=tk.TOP, fill=tk.X)
-category_scrollbar = ttk.Scrollbar(category_frame, orient=tk.VERTICAL)
-category_listbox = tk.Listbox(category_frame, yscrollcommand=zipcode_scrollbar.set, exportselection=0)
-category_scrollbar.config(command=category_listbox.yview)
-category_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-category_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-category_listbox.bind("<<ListboxSelect>>", on_category_selected)
-
-# Set up the business treeview with the corrected columns
-business_frame = tk.Frame(root)
-business_frame.grid(row=0, column=1, rowspan=5, sticky='nsew', padx=10, pady=5)
-business_treeview = ttk.Treeview(business_frame, columns=("name", "address", "city", "stars", "review_count", "review_rating", "num_checkins"), show='headings')
-business_treeview.pack(fill=tk.BOTH, expand=True)
-
-# Configure column headings
-business_treeview.heading('name', text='Business Name')
-business_treeview.heading('address', text='Address')
-business_treeview.heading('city', text='City')
-business_treeview.heading('stars', text='Stars')
-business_treeview.heading('review_count', text='Review Count')
-business_treeview.heading('review_rating', text='Review Rating')  # Add this line for the Review Rating heading
-business_treeview.heading('num_checkins', text='Number of Check-ins')
-
-# Configure column widths (you can adjust these as needed)
-business_treeview.column('name', minwidth=0, width=200, stretch=tk.NO)
-business_treeview.column('address', minwidth=0, width=200, stretch=tk.NO)
-business_treeview.column('city', minwidth=0, width=100, stretch=tk.NO)
-business_treeview.column('stars', minwidth=0, width=50, stretch=tk.NO)
-business_treeview.column('review_count', minwidth=0, width=100, stretch=tk.NO)
-business_treeview.column('review_rating', minwidth=0, width=100, stretch=tk.NO)  # Add this line to configure the Review Rating column
-business_treeview.column('num_checkins', minwidth=0, width=130, stretch=tk.NO)
-
-#Set up the search button
-search_button = ttk.Button(root, text="Search", command=on_search_clicked)
-search_button.grid(row=5, column=0, padx=10, pady=5, sticky='ew')
-
-# Set up the zipcode statistics frame
-stats_frame = tk.Frame(root)
-stats_frame.grid(row=0, column=2, rowspan=4, sticky='nsew', padx=10, pady=5)
-stats_label = ttk.Label(stats_frame, text="Zipcode Statistics")
-stats_label.pack(side=tk.TOP, fill=tk.X)
-num_businesses_label = ttk.Label(stats_frame, text="Number of Businesses: ")
-num_businesses_label.pack(side=tk.TOP, anchor='w')
-population_label = ttk.Label(stats_frame, text="Total Population: ")
-population_label.pack(side=tk.TOP, anchor='w')
-avg_income_label = ttk.Label(stats_frame, text="Average Income: ")
-avg_income_label.pack(side=tk.TOP, anchor='w')
-
-# Set up the clear button
-clear_button = ttk.Button(root, text="Clear", command=clear_all)
-clear_button.grid(row=6, column=0, padx=10, pady=5, sticky='ew')
-
-# Add a new frame and listbox to display top business categories
-top_categories_frame = tk.Frame(root)
-top_categories_frame.grid(row=1, column=2, rowspan=4, sticky='nsew', padx=10, pady=5)
-top_categories_label = ttk.Label(top_categories_frame, text="Top Categories")
-top_categories_label.pack(side=tk.TOP, fill=tk.X)
-top_categories_scrollbar = ttk.Scrollbar(top_categories_frame, orient=tk.VERTICAL)
-top_categories_listbox = tk.Listbox(top_categories_frame, yscrollcommand=top_categories_scrollbar.set, exportselection=0)
-top_categories_scrollbar.config(command=top_categories_listbox.yview)
-top_categories_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-top_categories_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-
-# Frame for the popular businesses
-popular_businesses_frame = ttk.Frame(root)
-popular_businesses_frame.grid(row=0, column=3, rowspan=5, padx=10, pady=5, sticky="nsew")
-
-# Label for the popular businesses frame
-popular_businesses_label = ttk.Label(popular_businesses_frame, text="Popular Businesses")
-popular_businesses_label.pack(side="top", fill="x")
-
-# Treeview for the popular businesses
-popular_businesses_treeview = ttk.Treeview(popular_businesses_frame, columns=("Business Name", "Stars", "Number of Check-ins"), show='headings')
-popular_businesses_treeview.heading('Business Name', text='Business Name')
-popular_businesses_treeview.heading('Stars', text='Stars')
-popular_businesses_treeview.heading('Number of Check-ins', text='Number of Check-ins')
-
-# Configuring the column headings
-popular_businesses_treeview.column('Business Name', anchor='center', width=200)
-popular_businesses_treeview.column('Stars', anchor='center', width=100)
-popular_businesses_treeview.column('Number of Check-ins', anchor='center', width=120)
-
-# Packing the treeview into the frame
-popular_businesses_treeview.pack(side="top", fill="both", expand=True)
-
-# Frame for the successful businesses
-successful_businesses_frame = ttk.Frame(root)
-successful_businesses_frame.grid(row=0, column=4, rowspan=5, padx=10, pady=5, sticky="nsew")
-
-# Label for the successful businesses frame
-successful_businesses_label = ttk.Label(successful_businesses_frame, text="Successful Businesses")
-successful_businesses_label.pack(side="top", fill="x")
-
-# Treeview for the successful businesses
-successful_businesses_treeview = ttk.Treeview(successful_businesses_frame, columns=("Business Name", "Start Date", "Review Count", "Check-in Count"), show='headings')
-successful_businesses_treeview.heading('Business Name', text='Business Name')
-successful_businesses_treeview.heading('Start Date', text='Start Date')
-successful_businesses_treeview.heading('Review Count', text='Review Count')
-successful_businesses_treeview.heading('Check-in Count', text='Check-in Count')
-
-# Configuring the column headings
-successful_businesses_treeview.column('Business Name', anchor='center', width=200)
-successful_businesses_treeview.column('Start Date', anchor='center', width=100)
-successful_businesses_treeview.column('Review Count', anchor='center', width=100)
-successful_businesses_treeview.column('Check-in Count', anchor='center', width=120)
-
-# Packing the treeview into the frame
-successful_businesses_treeview.pack(side="top", fill="both", expand=True)
-
-# Set up the refresh button for both popular and successful businesses
-refresh_button = ttk.Button(root, text="Refresh Business Views", command=lambda: update_business_views(zipcode_listbox.get(zipcode_listbox.curselection())))
-refresh_button.grid(row=7, column=3, padx=10, pady=5, sticky='ew')
-
-
-# Populate the state listbox
-for state in list_states():
-    state_listbox.insert(tk.END, state[0])
-
-root.mainloop()
\ No newline at end of file
+
+# The window is only built when run as a script, so the query functions can be
+# imported by tools without opening a window
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Yelp business browser")
+    parser.add_argument('--snapshot', help="browse a file written by Ryan_and_Stef_snapshot.py export "
+                                           "instead of querying the database for the filters")
+    parser.add_argument('--database', default=service.DB_SETTINGS['database'], help="database to browse")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help="print milliseconds to imports done, window built, first paint and first data")
+    parser.add_argument('--exit-after-startup', action='store_true',
+                        help="close the window once the state list has loaded (for startup benchmarks)")
+    args = parser.parse_args()
+    service.DB_SETTINGS['database'] = args.database
+    startup.enabled = args.profile_startup
+    exit_after_startup = args.exit_after_startup
+    instrument.install()
+
+    # Set up the main window
+    root = tk.Tk()
+    root.title("Milestone 1 - page1")
+    root.bind("<Map>", lambda event: startup.mark('first_paint'), add='+')
+    runner = QueryRunner(root)
+
+    # Create a label for the header 'State/City'
+    header_label = ttk.Label(root, text="State/City")
+    header_label.grid(row=0, column=0, padx=10, pady=5)
+
+    # Set up the state listbox with a label
+    state_frame = tk.Frame(root)
+    state_frame.grid(row=0, column=0, sticky='nwes', padx=10)
+    state_label = ttk.Label(state_frame, text="State")
+    state_label.pack(side=tk.TOP, fill=tk.X)
+    state_scrollbar = ttk.Scrollbar(state_frame, orient=tk.VERTICAL)
+    state_listbox = tk.Listbox(state_frame, height=10, yscrollcommand=state_scrollbar.set, exportselection=0)
+    state_scrollbar.config(command=state_listbox.yview)
+    state_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+    state_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+    state_listbox.bind("<<ListboxSelect>>", on_state_selected)
+
+    # Set up the city listbox with a label
+    city_frame = tk.Frame(root)
+    city_frame.grid(row=1, column=0, sticky='nwes', padx=10)
+    city_label = ttk.Label(city_frame, text="City")
+    city_label.pack(side=tk.TOP, fill=tk.X)
+    city_scrollbar = ttk.Scrollbar(city_frame, orient=tk.VERTICAL)
+    city_listbox = tk.Listbox(city_frame, yscrollcommand=city_scrollbar.set, exportselection=0)
+    city_scrollbar.config(command=city_listbox.yview)
+    city_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+    city_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+    city_listbox.bind("<<ListboxSelect>>", on_city_selected)
+
+    # Set up the zipcode with a label
+    zipcode_frame = tk.Frame(root)
+    zipcode_frame.grid(row=3, column=0, sticky='nwes', padx=10)
+    zipcode_label = ttk.Label(zipcode_frame, text="Zipcode")
+    zipcode_label.pack(side=tk.TOP, fill=tk.X)
+    zipcode_scrollbar = ttk.Scrollbar(zipcode_frame, orient=tk.VERTICAL)
+    zipcode_listbox = tk.Listbox(zipcode_frame, yscrollcommand=zipcode_scrollbar.set, exportselection=0)
+    zipcode_scrollbar.config(command=zipcode_listbox.yview)
+    zipcode_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+    zipcode_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+    zipcode_listbox.bind("<<ListboxSelect>>", on_zipcode_selected)
+
+    # Set up the category with a label
+    category_frame = tk.Frame(root)
+    category_frame.grid(row=4, column=0, sticky='nwes', padx=10)
+    category_label = ttk.Label(category_frame, text="Category")
+    category_label.pack(side=tk.TOP, fill=tk.X)
+    category_scrollbar = ttk.Scrollbar(category_frame, orient=tk.VERTICAL)
+    category_listbox = tk.Listbox(category_frame, yscrollcommand=zipcode_scrollbar.set, exportselection=0)
+    category_scrollbar.config(command=category_listbox.yview)
+    category_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+    category_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+    category_listbox.bind("<<ListboxSelect>>", on_category_selected)
+
+    # Set up the business treeview with the corrected columns
+    business_frame = tk.Frame(root)
+    business_frame.grid(row=0, column=1, rowspan=5, sticky='nsew', padx=10, pady=5)
+    business_count_label = ttk.Label(business_frame, text="")
+    business_count_label.pack(side=tk.BOTTOM, anchor='w')
+    business_scrollbar = ttk.Scrollbar(business_frame, orient=tk.VERTICAL)
+    business_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+    business_treeview = ttk.Treeview(business_frame, columns=("name", "address", "city", "stars", "review_count", "review_rating", "num_checkins"), show='headings')
+    business_treeview.pack(fill=tk.BOTH, expand=True)
+    business_pager = PagedTreeview(business_treeview, business_scrollbar, business_count_label, 'businesses')
+    business_treeview.bind("<<TreeviewSelect>>", on_business_selected)
+
+    # Configure column headings
+    business_treeview.heading('name', text='Business Name')
+    business_treeview.heading('address', text='Address')
+    business_treeview.heading('city', text='City')
+    business_treeview.heading('stars', text='Stars')
+    business_treeview.heading('review_count', text='Review Count')
+    business_treeview.heading('review_rating', text='Review Rating')  # Add this line for the Review Rating heading
+    business_treeview.heading('num_checkins', text='Number of Check-ins')
+
+    # Configure column widths (you can adjust these as needed)
+    business_treeview.column('name', minwidth=0, width=200, stretch=tk.NO)
+    business_treeview.column('address', minwidth=0, width=200, stretch=tk.NO)
+    business_treeview.column('city', minwidth=0, width=100, stretch=tk.NO)
+    business_treeview.column('stars', minwidth=0, width=50, stretch=tk.NO)
+    business_treeview.column('review_count', minwidth=0, width=100, stretch=tk.NO)
+    business_treeview.column('review_rating', minwidth=0, width=100, stretch=tk.NO)  # Add this line to configure the Review Rating column
+    business_treeview.column('num_checkins', minwidth=0, width=130, stretch=tk.NO)
+
+    #Set up the search button
+    search_button = ttk.Button(root, text="Search", command=on_search_clicked)
+    search_button.grid(row=5, column=0, padx=10, pady=5, sticky='ew')
+
+    # Review text search, next to the Search button
+    review_search_frame = tk.Frame(root)
+    review_search_frame.grid(row=7, column=0, padx=10, pady=5, sticky='ew')
+    review_search_entry = ttk.Entry(review_search_frame)
+    review_search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
+    review_search_entry.bind("<Return>", on_review_search_clicked)
+    review_search_button = ttk.Button(review_search_frame, text="Search Reviews", command=on_review_search_clicked)
+    review_search_button.pack(side=tk.RIGHT)
+
+    # Businesses matching the review search, with the best matching snippet
+    review_matches_frame = tk.Frame(root)
+    review_matches_frame.grid(row=5, column=2, rowspan=4, sticky='nsew', padx=10, pady=5)
+    review_matches_label = ttk.Label(review_matches_frame, text="Review Matches")
+    review_matches_label.pack(side=tk.TOP, fill=tk.X)
+    review_matches_treeview = ttk.Treeview(review_matches_frame, columns=("name", "matches", "snippet"),
+                                           show='headings', height=8)
+    review_matches_treeview.heading('name', text='Business Name')
+    review_matches_treeview.heading('matches', text='Matching Reviews')
+    review_matches_treeview.heading('snippet', text='Snippet')
+    review_matches_treeview.column('name', minwidth=0, width=180, stretch=tk.NO)
+    review_matches_treeview.column('matches', minwidth=0, width=110, stretch=tk.NO)
+    review_matches_treeview.column('snippet', minwidth=0, width=400, stretch=tk.YES)
+    review_matches_treeview.pack(fill=tk.BOTH, expand=True)
+
+    # Set up the zipcode statistics frame
+    stats_frame = tk.Frame(root)
+    stats_frame.grid(row=0, column=2, rowspan=4, sticky='nsew', padx=10, pady=5)
+    stats_label = ttk.Label(stats_frame, text="Zipcode Statistics")
+    stats_label.pack(side=tk.TOP, fill=tk.X)
+    num_businesses_label = ttk.Label(stats_frame, text="Number of Businesses: ")
+    num_businesses_label.pack(side=tk.TOP, anchor='w')
+    population_label = ttk.Label(stats_frame, text="Total Population: ")
+    population_label.pack(side=tk.TOP, anchor='w')
+    avg_income_label = ttk.Label(stats_frame, text="Average Income: ")
+    avg_income_label.pack(side=tk.TOP, anchor='w')
+
+    # Zipcode analytics: density, income percentile and category mix compared
+    # with zipcodes of similar income
+    analytics_frame = tk.Frame(root)
+    analytics_frame.grid(row=5, column=1, rowspan=4, sticky='nsew', padx=10, pady=5)
+    analytics_label = ttk.Label(analytics_frame, text="Zipcode Analytics")
+    analytics_label.pack(side=tk.TOP, fill=tk.X)
+    analytics_treeview = ttk.Treeview(analytics_frame, columns=("measure", "value"), show='headings', height=8)
+    analytics_treeview.heading('measure', text='Measure')
+    analytics_treeview.heading('value', text='Value')
+    analytics_treeview.column('measure', minwidth=0, width=320, stretch=tk.NO)
+    analytics_treeview.column('value', minwidth=0, width=100, stretch=tk.NO)
+    analytics_treeview.pack(fill=tk.BOTH, expand=True)
+
+    # Set up the clear button
+    clear_button = ttk.Button(root, text="Clear", command=clear_all)
+    clear_button.grid(row=6, column=0, padx=10, pady=5, sticky='ew')
+
+    # Add a new frame and listbox to display top business categories
+    top_categories_frame = tk.Frame(root)
+    top_categories_frame.grid(row=1, column=2, rowspan=4, sticky='nsew', padx=10, pady=5)
+    top_categories_label = ttk.Label(top_categories_frame, text="Top Categories")
+    top_categories_label.pack(side=tk.TOP, fill=tk.X)
+    top_categories_scrollbar = ttk.Scrollbar(top_categories_frame, orient=tk.VERTICAL)
+    top_categories_listbox = tk.Listbox(top_categories_frame, yscrollcommand=top_categories_scrollbar.set, exportselection=0)
+    top_categories_scrollbar.config(command=top_categories_listbox.yview)
+    top_categories_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+    top_categories_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+    # Frame for the popular businesses
+    popular_businesses_frame = ttk.Frame(root)
+    popular_businesses_frame.grid(row=0, column=3, rowspan=5, padx=10, pady=5, sticky="nsew")
+
+    # Label for the popular businesses frame
+    popular_businesses_label = ttk.Label(popular_businesses_frame, text="Popular Businesses")
+    popular_businesses_label.pack(side="top", fill="x")
+
+    # Treeview for the popular businesses
+    popular_businesses_treeview = ttk.Treeview(popular_businesses_frame, columns=("Business Name", "Stars", "Number of Check-ins"), show='headings')
+    popular_businesses_treeview.heading('Business Name', text='Business Name')
+    popular_businesses_treeview.heading('Stars', text='Stars')
+    popular_businesses_treeview.heading('Number of Check-ins', text='Number of Check-ins')
+
+    # Configuring the column headings
+    popular_businesses_treeview.column('Business Name', anchor='center', width=200)
+    popular_businesses_treeview.column('Stars', anchor='center', width=100)
+    popular_businesses_treeview.column('Number of Check-ins', anchor='center', width=120)
+
+    # Packing the treeview into the frame
+    popular_count_label = ttk.Label(popular_businesses_frame, text="")
+    popular_count_label.pack(side="bottom", anchor='w')
+    popular_scrollbar = ttk.Scrollbar(popular_businesses_frame, orient=tk.VERTICAL)
+    popular_scrollbar.pack(side="right", fill="y")
+    popular_businesses_treeview.pack(side="top", fill="both", expand=True)
+    popular_pager = PagedTreeview(popular_businesses_treeview, popular_scrollbar, popular_count_label, 'popular')
+
+    # Frame for the successful businesses
+    successful_businesses_frame = ttk.Frame(root)
+    successful_businesses_frame.grid(row=0, column=4, rowspan=5, padx=10, pady=5, sticky="nsew")
+
+    # Label for the successful businesses frame
+    successful_businesses_label = ttk.Label(successful_businesses_frame, text="Successful Businesses")
+    successful_businesses_label.pack(side="top", fill="x")
+
+    # Treeview for the successful businesses
+    successful_businesses_treeview = ttk.Treeview(successful_businesses_frame, columns=("Business Name", "Start Date", "Review Count", "Check-in Count"), show='headings')
+    successful_businesses_treeview.heading('Business Name', text='Business Name')
+    successful_businesses_treeview.heading('Start Date', text='Start Date')
+    successful_businesses_treeview.heading('Review Count', text='Review Count')
+    successful_businesses_treeview.heading('Check-in Count', text='Check-in Count')
+
+    # Configuring the column headings
+    successful_businesses_treeview.column('Business Name', anchor='center', width=200)
+    successful_businesses_treeview.column('Start Date', anchor='center', width=100)
+    successful_businesses_treeview.column('Review Count', anchor='center', width=100)
+    successful_businesses_treeview.column('Check-in Count', anchor='center', width=120)
+
+    # Packing the treeview into the frame
+    successful_count_label = ttk.Label(successful_businesses_frame, text="")
+    successful_count_label.pack(side="bottom", anchor='w')
+    successful_scrollbar = ttk.Scrollbar(successful_businesses_frame, orient=tk.VERTICAL)
+    successful_scrollbar.pack(side="right", fill="y")
+    successful_businesses_treeview.pack(side="top", fill="both", expand=True)
+    successful_pager = PagedTreeview(successful_businesses_treeview, successful_scrollbar, successful_count_label, 'successful')
+
+    # Set up the refresh button for both popular and successful businesses
+    refresh_button = ttk.Button(root, text="Refresh Business Views", command=lambda: update_business_views(zipcode_listbox.get(zipcode_listbox.curselection())))
+    refresh_button.grid(row=7, column=3, padx=10, pady=5, sticky='ew')
+
+    # Set up the button for the state-wide popular businesses
+    state_popular_button = ttk.Button(root, text="Popular in State", command=update_state_popular_businesses)
+    state_popular_button.grid(row=8, column=3, padx=10, pady=5, sticky='ew')
+
+    # Loading status, e.g. while the state list is read
+    status_label = ttk.Label(root, text="")
+    status_label.grid(row=8, column=0, padx=10, pady=5, sticky='w')
+    startup.mark('window_built')
+
+    # Populate the state listbox
+    load_states(args.snapshot)
+
+    root.mainloop()
+    runner.shutdown()
+    print(f"Query cache: {service.query_cache.stats()}")
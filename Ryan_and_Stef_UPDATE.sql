@@ -1,18 +1,26 @@
-UPDATE Business
-SET num_checkins = COALESCE((
-    SELECT SUM(num_checkins)
+-- Set-based recompute of the Business aggregates: one grouped pass over CheckIn
+-- and one over Review, joined back to Business. The loader normally maintains
+-- these itself (see --aggregates in Ryan_and_Stef_Parser_v3.py).
+-- A --checkin-storage histogram load leaves CheckIn empty, so checkins come
+-- from CheckInHistogram where a business has a row there, as in BusinessSummary.
+UPDATE Business b
+SET num_checkins = COALESCE(h.total_checkins, ci.num_checkins, 0)
+FROM Business b2
+LEFT JOIN CheckInHistogram h ON h.business_id = b2.business_id
+LEFT JOIN (
+    SELECT business_id, SUM(num_checkins) AS num_checkins
     FROM CheckIn
-    WHERE CheckIn.business_id = Business.business_id
-), 0);
+    GROUP BY business_id
+) ci ON ci.business_id = b2.business_id
+WHERE b.business_id = b2.business_id;
 
-UPDATE Business
-SET num_reviews = COALESCE((
-    SELECT COUNT(*)
+UPDATE Business b
+SET num_reviews = COALESCE(r.num_reviews, 0),
+    stars = COALESCE(r.avg_stars, 0)
+FROM Business b2
+LEFT JOIN (
+    SELECT business_id, COUNT(*) AS num_reviews, AVG(stars) AS avg_stars
     FROM Review
-    WHERE Review.business_id = Business.business_id
-), 0),
-stars = COALESCE((
-    SELECT AVG(stars)
-    FROM Review
-    WHERE Review.business_id = Business.business_id
-), 0);
\ No newline at end of file
+    GROUP BY business_id
+) r ON r.business_id = b2.business_id
+WHERE b.business_id = b2.business_id;
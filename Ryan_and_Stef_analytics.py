@@ -0,0 +1,268 @@
+import argparse
+import json
+import numpy as np
+from scipy import stats
+import Ryan_and_Stef_Service as service
+
+# Every zipcode with businesses in one round trip: business metrics from
+# BusinessSummary, its ZipcodeStats row, and its category mix as parallel arrays
+ZIPCODE_METRICS = """
+    WITH metrics AS (
+        SELECT b.zipcode, COUNT(*) AS businesses, AVG(b.stars) AS avg_stars,
+               SUM(s.total_checkins) AS checkins, SUM(s.review_count) AS reviews
+        FROM Business b
+        JOIN BusinessSummary s ON s.business_id = b.business_id
+        WHERE b.zipcode IS NOT NULL
+        GROUP BY b.zipcode
+    ),
+    category_mix AS (
+        SELECT zipcode, array_agg(name) AS categories, array_agg(businesses) AS category_counts
+        FROM (
+            SELECT b.zipcode, c.name, COUNT(*) AS businesses
+            FROM BusinessCategory bc
+            JOIN Category c ON c.category_id = bc.category_id
+            JOIN Business b ON b.business_id = bc.business_id
+            WHERE b.zipcode IS NOT NULL
+            GROUP BY b.zipcode, c.name
+        ) counts
+        GROUP BY zipcode
+    )
+    SELECT m.zipcode, m.businesses, m.avg_stars, m.checkins, m.reviews,
+           zs.medianIncome, zs.meanIncome, zs.population,
+           COALESCE(cm.categories, '{}'), COALESCE(cm.category_counts, '{}')
+    FROM metrics m
+    LEFT JOIN ZipcodeStats zs ON zs.zipcode = m.zipcode
+    LEFT JOIN category_mix cm ON cm.zipcode = m.zipcode
+    ORDER BY m.zipcode
+"""
+INCOME_MEASURES = ('median_income', 'mean_income', 'population')
+BUSINESS_MEASURES = ('density', 'avg_stars', 'checkins_per_business', 'reviews_per_business')
+# Zipcodes are compared with others in the same median income quartile
+INCOME_GROUPS = 4
+# Pseudo-count that keeps a category seen once or twice from dominating the ratios
+SMOOTHING = 0.5
+
+def fetch_rows():
+    task = service.current_task.get()
+    with service.get_pool().connection() as conn:
+        if task:
+            task.attach(conn)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(ZIPCODE_METRICS)
+                return cur.fetchall()
+        finally:
+            if task:
+                task.detach(conn)
+
+def float_column(rows, index):
+    return np.array([np.nan if row[index] is None else float(row[index]) for row in rows])
+
+def per(numerator, denominator, scale=1):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = numerator * scale / denominator
+    result[~np.isfinite(result)] = np.nan
+    return result
+
+# Correlation of each column of y with x over the rows where both are known,
+# computed on ranks (Spearman) for all columns at once
+def rank_correlations(x, y):
+    correlations = np.full(y.shape[1], np.nan)
+    known = np.isfinite(x)
+    if known.sum() < 3:
+        return correlations
+    x_ranks = stats.rankdata(x[known])
+    y_ranks = stats.rankdata(y[known], axis=0)
+    x_centered = x_ranks - x_ranks.mean()
+    y_centered = y_ranks - y_ranks.mean(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        correlations = (x_centered @ y_centered) / np.sqrt((x_centered ** 2).sum() * (y_centered ** 2).sum(axis=0))
+    return correlations
+
+# ZipcodeStats joined with business metrics for every zipcode, as arrays
+# indexed by zipcode position (and category position for the category mix)
+class ZipcodeAnalytics:
+    def __init__(self, rows):
+        self.zipcodes = [row[0] for row in rows]
+        self.position = {zipcode: index for index, zipcode in enumerate(self.zipcodes)}
+        self.businesses = float_column(rows, 1)
+        self.avg_stars = float_column(rows, 2)
+        self.checkins = float_column(rows, 3)
+        self.reviews = float_column(rows, 4)
+        self.median_income = float_column(rows, 5)
+        self.mean_income = float_column(rows, 6)
+        self.population = float_column(rows, 7)
+
+        self.categories = sorted({name for row in rows for name in row[8]})
+        category_position = {name: index for index, name in enumerate(self.categories)}
+        self.category_counts = np.zeros((len(rows), len(self.categories)))
+        for index, row in enumerate(rows):
+            columns = [category_position[name] for name in row[8]]
+            self.category_counts[index, columns] = row[9]
+
+        self.density = per(self.businesses, self.population, 1000)
+        self.checkins_per_business = per(self.checkins, self.businesses)
+        self.reviews_per_business = per(self.reviews, self.businesses)
+        self.compute_representation()
+
+    def compute_representation(self):
+        # Expected category shares come from the zipcode's income quartile; zipcodes
+        # without income data are compared with all zipcodes
+        known = np.isfinite(self.median_income)
+        self.income_group = np.full(len(self.zipcodes), -1)
+        if known.any():
+            edges = np.quantile(self.median_income[known], np.linspace(0, 1, INCOME_GROUPS + 1)[1:-1])
+            self.income_group[known] = np.searchsorted(edges, self.median_income[known], side='right')
+        totals = self.category_counts.sum(axis=1)
+        overall = self.category_counts.sum(axis=0) / max(self.category_counts.sum(), 1)
+        expected_share = np.tile(overall, (len(self.zipcodes), 1))
+        for group in range(INCOME_GROUPS):
+            members = self.income_group == group
+            if members.any():
+                group_counts = self.category_counts[members].sum(axis=0)
+                expected_share[members] = group_counts / max(group_counts.sum(), 1)
+        self.expected_counts = expected_share * totals[:, None]
+        # Above 1: the category is more common here than in zipcodes of similar income
+        self.representation = (self.category_counts + SMOOTHING) / (self.expected_counts + SMOOTHING)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            shares = self.category_counts / totals[:, None]
+        shares[~np.isfinite(shares)] = 0
+        self.category_income_correlation = rank_correlations(self.median_income, shares)
+
+    def measure(self, name):
+        return getattr(self, name)
+
+    def correlations(self):
+        results = []
+        for income_name in INCOME_MEASURES:
+            income = self.measure(income_name)
+            for business_name in BUSINESS_MEASURES:
+                values = self.measure(business_name)
+                known = np.isfinite(income) & np.isfinite(values)
+                if known.sum() < 3:
+                    continue
+                pearson = stats.pearsonr(income[known], values[known])
+                spearman = stats.spearmanr(income[known], values[known])
+                results.append({
+                    'x': income_name,
+                    'y': business_name,
+                    'zipcodes': int(known.sum()),
+                    'pearson': float(pearson[0]),
+                    'spearman': float(spearman[0]),
+                    'p_value': float(spearman[1]),
+                })
+        return results
+
+    def percentile(self, name, index):
+        values = self.measure(name)
+        known = values[np.isfinite(values)]
+        if not np.isfinite(values[index]) or not len(known):
+            return None
+        return float(stats.percentileofscore(known, values[index], kind='mean'))
+
+    # Categories most over- and under-represented in a zipcode, ignoring those
+    # that would not be expected to appear at least min_expected times
+    def representation_for(self, index, top=5, min_expected=1.0):
+        candidates = np.flatnonzero((self.expected_counts[index] >= min_expected) | (self.category_counts[index] > 0))
+        ratios = self.representation[index, candidates]
+        order = np.argsort(ratios)
+        def describe(positions):
+            return [{'category': self.categories[candidates[position]],
+                     'businesses': int(self.category_counts[index, candidates[position]]),
+                     'expected': float(self.expected_counts[index, candidates[position]]),
+                     'ratio': float(ratios[position])}
+                    for position in positions]
+        over = [entry for entry in describe(order[::-1][:top]) if entry['ratio'] > 1]
+        under = [entry for entry in describe(order[:top]) if entry['ratio'] < 1]
+        return over, under
+
+    def zipcode_report(self, zipcode, top=5):
+        index = self.position.get(zipcode)
+        if index is None:
+            return None
+        over, under = self.representation_for(index, top)
+        return {
+            'zipcode': zipcode,
+            'businesses': int(self.businesses[index]),
+            'population': None if np.isnan(self.population[index]) else int(self.population[index]),
+            'median_income': None if np.isnan(self.median_income[index]) else int(self.median_income[index]),
+            'income_percentile': self.percentile('median_income', index),
+            'density': None if np.isnan(self.density[index]) else float(self.density[index]),
+            'density_percentile': self.percentile('density', index),
+            'checkins_per_business': float(self.checkins_per_business[index]),
+            'over_represented': over,
+            'under_represented': under,
+        }
+
+    def income_skewed_categories(self, top=10):
+        known = np.flatnonzero(np.isfinite(self.category_income_correlation))
+        order = known[np.argsort(self.category_income_correlation[known])]
+        def describe(positions):
+            return [{'category': self.categories[position],
+                     'correlation': float(self.category_income_correlation[position])} for position in positions]
+        return {'higher_income': [entry for entry in describe(order[::-1][:top]) if entry['correlation'] > 0],
+                'lower_income': [entry for entry in describe(order[:top]) if entry['correlation'] < 0]}
+
+# Cached like the zipcode panels, so the bulk query runs once per data generation
+@service.cached
+def zipcode_analytics():
+    return ZipcodeAnalytics(fetch_rows())
+
+def zipcode_report(zipcode):
+    analytics = zipcode_analytics()
+    return analytics.zipcode_report(zipcode), analytics.correlations()
+
+def format_number(value, spec):
+    return "N/A" if value is None else format(value, spec)
+
+def print_report(analytics, zipcode=None, top=10):
+    print(f"{len(analytics.zipcodes)} zipcodes, {np.isfinite(analytics.median_income).sum()} with income data, "
+          f"{len(analytics.categories)} categories\n")
+    print(f"{'income measure':<16} {'business measure':<24} {'zipcodes':>8} {'pearson':>8} {'spearman':>9} {'p':>9}")
+    for result in analytics.correlations():
+        print(f"{result['x']:<16} {result['y']:<24} {result['zipcodes']:>8} {result['pearson']:>8.3f} "
+              f"{result['spearman']:>9.3f} {result['p_value']:>9.2g}")
+    skewed = analytics.income_skewed_categories(top)
+    print("\nCategories most common in higher income zipcodes:")
+    for entry in skewed['higher_income']:
+        print(f"  {entry['correlation']:+.3f}  {entry['category']}")
+    print("Categories most common in lower income zipcodes:")
+    for entry in skewed['lower_income']:
+        print(f"  {entry['correlation']:+.3f}  {entry['category']}")
+    if zipcode:
+        report = analytics.zipcode_report(zipcode, top)
+        if report is None:
+            print(f"\nNo businesses in zipcode {zipcode}")
+            return
+        print(f"\nZipcode {zipcode}: {report['businesses']} businesses, "
+              f"{format_number(report['density'], '.2f')} per 1,000 residents "
+              f"(percentile {format_number(report['density_percentile'], '.0f')}), "
+              f"income percentile {format_number(report['income_percentile'], '.0f')}")
+        for label, entries in (('Over-represented', report['over_represented']),
+                               ('Under-represented', report['under_represented'])):
+            print(f"{label} for its income bracket:")
+            for entry in entries:
+                print(f"  {entry['ratio']:5.2f}x  {entry['category']} "
+                      f"({entry['businesses']} vs {entry['expected']:.1f} expected)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Correlate ZipcodeStats with business metrics across all zipcodes")
+    parser.add_argument('--database', default=service.DB_SETTINGS['database'], help="database to analyse")
+    parser.add_argument('--zipcode', help="also report category representation for this zipcode")
+    parser.add_argument('--top', type=int, default=10, help="categories listed per ranking (default 10)")
+    parser.add_argument('--json', help="write the correlations (and zipcode report) to this file")
+    args = parser.parse_args()
+
+    service.DB_SETTINGS['database'] = args.database
+    analytics = ZipcodeAnalytics(fetch_rows())
+    print_report(analytics, args.zipcode, args.top)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'correlations': analytics.correlations(),
+                'income_skewed_categories': analytics.income_skewed_categories(args.top),
+                'zipcode': analytics.zipcode_report(args.zipcode, args.top) if args.zipcode else None,
+            }, f, indent=2)
+
+if __name__ == "__main__":
+    main()
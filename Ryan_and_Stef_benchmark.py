@@ -0,0 +1,210 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import psycopg2
+import Ryan_and_Stef_Parser_v3 as loader
+import Ryan_and_Stef_Service as service
+
+UI_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Ryan_and_Stef_UI.py')
+STARTUP_PREFIX = 'Startup profile: '
+LOADED_TABLES = ['BusinessCategory', 'Review', 'CheckIn', 'CheckInHistogram', 'YelpUser', 'Business', 'Category',
+                 'RecordFingerprint', 'LoadProgress']
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Loads every file into an emptied benchmark database, following the loader's
+# dependency plan, and times each stage
+def benchmark_loader(conn, data_dir, loader_argv):
+    args = loader.parse_args(['--data-dir', data_dir, '--restart', *loader_argv])
+    cur = conn.cursor()
+    cur.execute(f"TRUNCATE {', '.join(LOADED_TABLES)} RESTART IDENTITY CASCADE;")
+    conn.commit()
+    aggregates = loader.Aggregates('CheckIn' if args.checkin_storage == 'rows' else 'CheckInHistogram')
+    started = time.perf_counter()
+    results = loader.load_files(conn, cur, args, aggregates)
+    results['files'] = {'seconds': time.perf_counter() - started}
+    started = time.perf_counter()
+    aggregates.apply(cur, args.aggregates)
+    conn.commit()
+    results['aggregates'] = {'seconds': time.perf_counter() - started}
+    started = time.perf_counter()
+    loader.refresh_summary(cur)
+    loader.bump_generation(cur)
+    conn.commit()
+    results['refresh_summary'] = {'seconds': time.perf_counter() - started}
+    cur.close()
+    return results
+
+def sample_selection(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT state, city, zipcode
+            FROM Business
+            GROUP BY state, city, zipcode
+            ORDER BY COUNT(*) DESC
+            LIMIT 1;
+        """)
+        state, city, zipcode = cur.fetchone()
+        cur.execute("""
+            SELECT c.name
+            FROM Category c
+            JOIN BusinessCategory bc ON c.category_id = bc.category_id
+            JOIN Business b ON bc.business_id = b.business_id
+            WHERE b.zipcode = %s
+            GROUP BY c.name
+            ORDER BY COUNT(*) DESC
+            LIMIT 1;
+        """, (zipcode,))
+        category = cur.fetchone()[0]
+    return state, city, zipcode, category
+
+def uncached(func):
+    return getattr(func, '__wrapped__', func)
+
+def uncached_async(coroutine_function, *args):
+    service.query_cache.clear()
+    return asyncio.run(coroutine_function(*args))
+
+def query_calls(state, city, zipcode, category):
+    return {
+        # A fresh index with no cache file measures the full location query
+        'load_locations': lambda: service.LocationIndex(cache_file=None).load(),
+        'list_categories': lambda: uncached(service.list_categories)(zipcode),
+        'list_top_categories': lambda: uncached(service.list_top_categories)(zipcode, 5),
+        'list_zipcode_stats': lambda: uncached(service.list_zipcode_stats)(zipcode),
+        'list_businesses': lambda: service.list_businesses(city, state, zipcode),
+        'list_businesses_category': lambda: service.list_businesses(city, state, zipcode, category),
+        # Whole listings through a server-side cursor, as the UI streams them
+        'stream_businesses': lambda: [row for batch in service.stream_businesses(city, state, zipcode)
+                                      for row in batch],
+        'count_businesses': lambda: service.count_businesses(city, state, zipcode),
+        'get_popular_businesses': lambda: uncached(service.get_popular_businesses)(zipcode),
+        'count_popular_businesses': lambda: uncached(service.count_popular_businesses)(zipcode),
+        'get_popular_businesses_in_state': lambda: uncached(service.get_popular_businesses_in_state)(state, 50),
+        'get_successful_businesses': lambda: uncached(service.get_successful_businesses)(zipcode),
+        'stream_successful_businesses': lambda: [row for batch in service.stream_successful_businesses(zipcode)
+                                                 for row in batch],
+        'count_zipcode_businesses': lambda: uncached(service.count_zipcode_businesses)(zipcode),
+        # The concurrent lookups behind one zipcode click; should track the slowest query above
+        'zipcode_overview': lambda: uncached_async(service.zipcode_overview, zipcode),
+        'business_views': lambda: uncached_async(service.business_views, zipcode),
+    }
+
+def benchmark_queries(calls, repeat):
+    results = {}
+    for name, call in calls.items():
+        # The first call prepares the statement on the pooled connection
+        result = call()
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            call()
+            timings.append((time.perf_counter() - started) * 1000)
+        results[name] = {
+            'median_ms': statistics.median(timings),
+            'min_ms': min(timings),
+            'max_ms': max(timings),
+            'rows': len(result) if isinstance(result, list) else None,
+        }
+        print(f"{name:<34} {results[name]['median_ms']:>9.2f} ms")
+    return results
+
+# Launches the UI until its state list has loaded, repeat times, and keeps the
+# median of each milestone it reports. Needs a display
+def benchmark_startup(database, repeat):
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        try:
+            completed = subprocess.run([sys.executable, UI_SCRIPT, '--database', database, '--profile-startup',
+                                        '--exit-after-startup'], capture_output=True, text=True, timeout=120)
+        except subprocess.TimeoutExpired:
+            print("UI startup timed out")
+            return None
+        profile = next((json.loads(line[len(STARTUP_PREFIX):]) for line in completed.stdout.splitlines()
+                        if line.startswith(STARTUP_PREFIX)), None)
+        if profile is None:
+            print(f"UI startup failed: {completed.stderr.strip()[-500:]}")
+            return None
+        profile['process'] = (time.perf_counter() - started) * 1000
+        runs.append(profile)
+    results = {name: statistics.median(run[name] for run in runs if name in run) for name in runs[0]}
+    for name, ms in results.items():
+        print(f"startup.{name:<26} {ms:>9.2f} ms")
+    return results
+
+def compare(report, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_path} (commit {baseline.get('commit')})")
+    rows = []
+    for section, key in (('loader', 'seconds'), ('queries', 'median_ms')):
+        for name, result in report.get(section, {}).items():
+            before = (baseline.get(section, {}).get(name) or {}).get(key)
+            if result and before:
+                rows.append((f"{section}.{name}", before, result[key]))
+    for name, after in (report.get('startup') or {}).items():
+        before = (baseline.get('startup') or {}).get(name)
+        if before:
+            rows.append((f"startup.{name}", before, after))
+    for name, before, after in rows:
+        change = (after - before) / before * 100 if before else 0
+        print(f"{name:<44} {before:>10.2f} {after:>10.2f} {change:>+8.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the loader and the UI queries against a local Postgres")
+    parser.add_argument('--database', default='milestone3bench',
+                        help="benchmark database; --load empties its tables (default milestone3bench)")
+    parser.add_argument('--data-dir', default='./Yelp-CptS451-synthetic',
+                        help="JSON files to load, e.g. from Ryan_and_Stef_generate_data.py")
+    parser.add_argument('--load', action='store_true', help="truncate the database and time a full load first")
+    parser.add_argument('--loader-arg', action='append', default=[],
+                        help="extra option passed to the loader, e.g. --loader-arg=--workers=8 or --loader-arg=--defer-fk")
+    parser.add_argument('--repeat', type=int, default=5, help="timed runs per query (default 5)")
+    parser.add_argument('--startup', type=int, default=0, metavar='RUNS',
+                        help="also launch the UI this many times and time its startup (needs a display)")
+    parser.add_argument('--output', default='bench_report.json', help="where the JSON report is written")
+    parser.add_argument('--compare', help="earlier report to compare against")
+    args = parser.parse_args()
+
+    service.DB_SETTINGS['database'] = args.database
+    loader.DB_SETTINGS['database'] = args.database
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'database': args.database,
+    }
+    conn = psycopg2.connect(**service.DB_SETTINGS)
+    try:
+        if args.load:
+            report['loader'] = benchmark_loader(conn, args.data_dir, args.loader_arg)
+        with conn.cursor() as cur:
+            cur.execute("SELECT (SELECT COUNT(*) FROM Business), (SELECT COUNT(*) FROM Review), "
+                        "(SELECT COUNT(*) FROM CheckIn);")
+            report['scale'] = dict(zip(('businesses', 'reviews', 'checkins'), cur.fetchone()))
+        selection = sample_selection(conn)
+    finally:
+        conn.close()
+    report['selection'] = dict(zip(('state', 'city', 'zipcode', 'category'), selection))
+    report['queries'] = benchmark_queries(query_calls(*selection), args.repeat)
+    if args.startup:
+        report['startup'] = benchmark_startup(args.database, args.startup)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+    if args.compare:
+        compare(report, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import argparse
+import json
+import psycopg2
+from Ryan_and_Stef_Service import (DB_SETTINGS, FIRST_BUSINESS_KEY, FIRST_POPULAR_KEY, FIRST_SUCCESSFUL_KEY, PAGE_SIZE,
+                                   QUERIES, SEARCH_LIMIT)
+
+DEFAULT_COST_BUDGET = 10000
+# Tables small enough that scanning them whole is the right plan
+SEQ_SCAN_ALLOWED = {'category', 'datageneration', 'zipcodestats'}
+SAMPLE_SEARCH = '"late night" OR "gluten free"'
+
+# Picks the busiest zipcode in the fixture database, and its most common
+# category, as parameters for every UI query
+def sample_parameters(cur):
+    cur.execute("""
+        SELECT state, city, zipcode
+        FROM Business
+        GROUP BY state, city, zipcode
+        ORDER BY COUNT(*) DESC
+        LIMIT 1;
+    """)
+    state, city, zipcode = cur.fetchone()
+    cur.execute("""
+        SELECT c.name
+        FROM Category c
+        JOIN BusinessCategory bc ON c.category_id = bc.category_id
+        JOIN Business b ON bc.business_id = b.business_id
+        WHERE b.zipcode = %s
+        GROUP BY c.name
+        ORDER BY COUNT(*) DESC
+        LIMIT 1;
+    """, (zipcode,))
+    category = cur.fetchone()[0]
+    cur.execute("SELECT business_id FROM Business WHERE zipcode = %s LIMIT 1;", (zipcode,))
+    business_id = cur.fetchone()[0]
+    return {
+        'data_generation': (),
+        'list_locations': (),
+        'list_categories': (zipcode,),
+        'list_businesses': (city, state, zipcode, *FIRST_BUSINESS_KEY, PAGE_SIZE),
+        'list_businesses_category': (city, state, zipcode, category, *FIRST_BUSINESS_KEY, PAGE_SIZE),
+        'count_businesses': (city, state, zipcode),
+        'count_businesses_category': (city, state, zipcode, category),
+        'list_top_categories': (zipcode, 5),
+        'list_zipcode_stats': (zipcode,),
+        'get_popular_businesses': (zipcode, *FIRST_POPULAR_KEY, PAGE_SIZE),
+        'count_popular_businesses': (zipcode,),
+        'get_popular_businesses_in_state': (state, 50),
+        'get_successful_businesses': (zipcode, *FIRST_SUCCESSFUL_KEY, PAGE_SIZE),
+        'count_zipcode_businesses': (zipcode,),
+        'checkin_histogram': (business_id,),
+        'search_reviews_zipcode': (SAMPLE_SEARCH, zipcode, SEARCH_LIMIT),
+        'search_reviews_city': (SAMPLE_SEARCH, city, state, SEARCH_LIMIT),
+    }
+
+def plan_nodes(node):
+    yield node
+    for child in node.get('Plans', []):
+        yield from plan_nodes(child)
+
+def explain(cur, name, params):
+    cur.execute(f"PREPARE {name} AS {QUERIES[name]}")
+    try:
+        if params:
+            cur.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) EXECUTE {name} ({', '.join(['%s'] * len(params))})",
+                        params)
+        else:
+            cur.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) EXECUTE {name}")
+        result = cur.fetchone()[0]
+    finally:
+        cur.execute(f"DEALLOCATE {name}")
+    # psycopg2 decodes the json column unless the server sent it as text
+    return (json.loads(result) if isinstance(result, str) else result)[0]
+
+def check_query(cur, name, params, cost_budget, planner_defaults):
+    plan = explain(cur, name, params)
+    root = plan['Plan']
+    # With seq scans disabled the planner only picks one when no index can be
+    # used, so a small fixture still shows missing indexes. Disabled nodes carry
+    # a huge cost penalty, so cost and timing come from the default plan above
+    if not planner_defaults:
+        cur.execute("SET enable_seqscan = off;")
+        try:
+            scan_plan = explain(cur, name, params)['Plan']
+        finally:
+            cur.execute("RESET enable_seqscan;")
+    else:
+        scan_plan = root
+    problems = []
+    for node in plan_nodes(scan_plan):
+        relation = node.get('Relation Name', '')
+        if node['Node Type'] == 'Seq Scan' and relation.lower() not in SEQ_SCAN_ALLOWED:
+            problems.append(f"seq scan on {relation}")
+    if root['Total Cost'] > cost_budget:
+        problems.append(f"cost {root['Total Cost']:.0f} over budget {cost_budget}")
+    return {
+        'query': name,
+        'cost': root['Total Cost'],
+        'time_ms': plan.get('Execution Time'),
+        'shared_hit': root.get('Shared Hit Blocks', 0),
+        'shared_read': root.get('Shared Read Blocks', 0),
+        'problems': problems,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="EXPLAIN every UI query against a fixture database and fail on plan regressions")
+    parser.add_argument('--database', default=DB_SETTINGS['database'], help="fixture database name")
+    parser.add_argument('--max-cost', type=float, default=DEFAULT_COST_BUDGET,
+                        help=f"planner cost budget per query (default {DEFAULT_COST_BUDGET})")
+    parser.add_argument('--planner-defaults', action='store_true',
+                        help="look for seq scans in the default plan only; by default the query is also "
+                             "planned with enable_seqscan off, so a seq scan means no usable index exists "
+                             "even on a small fixture")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**dict(DB_SETTINGS, database=args.database))
+    conn.autocommit = True
+    cur = conn.cursor()
+    try:
+        parameters = sample_parameters(cur)
+        missing = set(QUERIES) - set(parameters)
+        if missing:
+            raise SystemExit(f"No sample parameters for: {', '.join(sorted(missing))}")
+        results = [check_query(cur, name, parameters[name], args.max_cost, args.planner_defaults)
+                   for name in QUERIES]
+    finally:
+        cur.close()
+        conn.close()
+
+    print(f"{'query':<28} {'cost':>10} {'time ms':>9} {'hit':>7} {'read':>7}  result")
+    for result in results:
+        verdict = '; '.join(result['problems']) or 'ok'
+        print(f"{result['query']:<28} {result['cost']:>10.0f} {result['time_ms'] or 0:>9.2f} "
+              f"{result['shared_hit']:>7} {result['shared_read']:>7}  {verdict}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    failures = [result for result in results if result['problems']]
+    if failures:
+        raise SystemExit(f"{len(failures)} of {len(results)} query plans failed the check")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import string
+import time
+
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+STATES = ['AZ', 'NV', 'NC', 'OH', 'PA', 'WI', 'IL', 'SC', 'MA', 'NH']
+CATEGORY_WORDS = ['Restaurants', 'Food', 'Nightlife', 'Bars', 'Shopping', 'Coffee & Tea', 'Pizza', 'Mexican',
+                  'Italian', 'Chinese', 'Japanese', 'Sushi Bars', 'Burgers', 'Sandwiches', 'Breakfast & Brunch',
+                  'Fast Food', 'American (New)', 'American (Traditional)', 'Bakeries', 'Desserts', 'Auto Repair',
+                  'Hair Salons', 'Nail Salons', 'Beauty & Spas', 'Home Services', 'Health & Medical', 'Dentists',
+                  'Doctors', 'Fitness & Instruction', 'Gyms', 'Hotels', 'Event Planning & Services', 'Pets',
+                  'Veterinarians', 'Active Life', 'Arts & Entertainment', 'Local Services', 'Real Estate',
+                  'Automotive', 'Grocery', 'Specialty Food', 'Vegan', 'Gluten-Free', 'Thai', 'Indian', 'Seafood',
+                  'Steakhouses', 'Wine Bars', 'Cocktail Bars', 'Sports Bars']
+WORDS = ('the food was great service slow friendly staff would come back again late night gluten free '
+         'prices reasonable portions huge parking terrible atmosphere cozy loud music best tacos in town '
+         'wait time long highly recommend never again delicious fresh clean dirty rude amazing ok').split()
+NAME_WORDS = ['Golden', 'Desert', 'Lucky', 'Blue', 'Red', 'Corner', 'Urban', 'Old Town', 'Sunny', 'Happy',
+              'Grill', 'Cafe', 'Kitchen', 'Bistro', 'Diner', 'Shop', 'Studio', 'House', 'Market', 'Garage']
+
+# Zipf-like weights: the i-th most popular item is chosen 1 / i**skew as often as the first
+def zipf_weights(count, skew):
+    return list(itertools.accumulate(1 / (rank ** skew) for rank in range(1, count + 1)))
+
+def make_id(rng):
+    return ''.join(rng.choices(string.ascii_letters + string.digits + '-_', k=22))
+
+def make_locations(rng, num_zipcodes):
+    locations = []
+    zipcodes = rng.sample(range(1000, 99999), num_zipcodes)
+    for index, zipcode in enumerate(zipcodes):
+        state = STATES[index % len(STATES)]
+        # A handful of cities per state, with some names shared across states
+        city = f"City {index % (len(STATES) * 4) // len(STATES)}"
+        locations.append((state, city, f"{zipcode:05d}"))
+    rng.shuffle(locations)
+    return locations
+
+def write_lines(path, records):
+    count = 0
+    with open(path, 'w') as f:
+        for record in records:
+            f.write(json.dumps(record))
+            f.write('\n')
+            count += 1
+    return count
+
+def generate_businesses(rng, args, locations, business_ids):
+    location_weights = zipf_weights(len(locations), args.skew)
+    category_weights = zipf_weights(len(CATEGORY_WORDS), args.skew)
+    for business_id in business_ids:
+        state, city, zipcode = rng.choices(locations, cum_weights=location_weights)[0]
+        categories = set(rng.choices(CATEGORY_WORDS, cum_weights=category_weights, k=rng.randint(1, 4)))
+        yield {
+            'business_id': business_id,
+            'name': f"{rng.choice(NAME_WORDS)} {rng.choice(NAME_WORDS)}",
+            'address': f"{rng.randint(1, 9999)} {rng.choice(NAME_WORDS)} St",
+            'state': state,
+            'city': city,
+            'postal_code': zipcode,
+            'stars': rng.randint(2, 10) / 2,
+            'review_count': 0,
+            'is_open': 1 if rng.random() < 0.85 else 0,
+            'categories': sorted(categories),
+        }
+
+def generate_reviews(rng, args, business_ids, user_ids):
+    # Popular businesses receive most of the reviews
+    business_weights = zipf_weights(len(business_ids), args.skew)
+    for _ in range(args.reviews):
+        yield {
+            'review_id': make_id(rng),
+            'user_id': rng.choice(user_ids),
+            'business_id': rng.choices(business_ids, cum_weights=business_weights)[0],
+            'stars': rng.randint(1, 5),
+            'date': f"{rng.randint(2005, 2018)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            'text': ' '.join(rng.choices(WORDS, k=rng.randint(10, 120))),
+        }
+
+def generate_users(rng, user_ids):
+    for user_id in user_ids:
+        yield {
+            'user_id': user_id,
+            'name': rng.choice(NAME_WORDS),
+            'review_count': int(rng.paretovariate(1.5)),
+        }
+
+def generate_checkins(rng, args, business_ids):
+    for business_id in business_ids:
+        if rng.random() > args.checkin_ratio:
+            continue
+        times = {}
+        busy = rng.paretovariate(1.2)
+        for day in DAYS:
+            hours = {f"{hour}:00": max(1, int(busy * rng.random() * 3))
+                     for hour in rng.sample(range(24), rng.randint(0, 12))}
+            if hours:
+                times[day] = hours
+        if times:
+            yield {'business_id': business_id, 'time': times}
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic Yelp JSON-lines files for benchmarking")
+    parser.add_argument('--out', default='./Yelp-CptS451-synthetic', help="output directory")
+    parser.add_argument('--reviews', type=int, default=10000, help="number of reviews (default 10000)")
+    parser.add_argument('--businesses', type=int, help="number of businesses (default reviews / 20)")
+    parser.add_argument('--users', type=int, help="number of users (default reviews / 5)")
+    parser.add_argument('--zipcodes', type=int, default=200, help="number of distinct zipcodes (default 200)")
+    parser.add_argument('--checkin-ratio', type=float, default=0.7,
+                        help="fraction of businesses with checkins (default 0.7)")
+    parser.add_argument('--skew', type=float, default=1.1,
+                        help="Zipf exponent for zipcode, category and review popularity (default 1.1)")
+    parser.add_argument('--seed', type=int, default=451, help="random seed, so runs are reproducible")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    num_businesses = args.businesses or max(1, args.reviews // 20)
+    num_users = args.users or max(1, args.reviews // 5)
+    os.makedirs(args.out, exist_ok=True)
+    started = time.perf_counter()
+
+    locations = make_locations(rng, args.zipcodes)
+    business_ids = [make_id(rng) for _ in range(num_businesses)]
+    user_ids = [make_id(rng) for _ in range(num_users)]
+    outputs = [
+        ('yelp_business.JSON', generate_businesses(rng, args, locations, business_ids)),
+        ('yelp_user.JSON', generate_users(rng, user_ids)),
+        ('yelp_review.JSON', generate_reviews(rng, args, business_ids, user_ids)),
+        ('yelp_checkin.JSON', generate_checkins(rng, args, business_ids)),
+    ]
+    for file_name, records in outputs:
+        count = write_lines(os.path.join(args.out, file_name), records)
+        print(f"Wrote {count} records to {file_name}")
+    print(f"Done in {time.perf_counter() - started:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+import argparse
+import atexit
+import json
+import logging
+import os
+import re
+import signal
+import threading
+import time
+import psycopg2
+import psycopg2.extensions
+
+# Statements slower than this (milliseconds) are logged with their parameters and plan
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 250))
+SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG', 'slow_queries.log')
+SLOW_QUERY_TEXT = 2000
+STATS_FILE = os.environ.get('QUERY_STATS_FILE', 'query_stats.json')
+# Upper bounds of the latency histogram buckets, in milliseconds
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, float('inf')]
+EXPLAINABLE = ('SELECT', 'WITH', 'EXECUTE', 'UPDATE', 'DELETE', 'INSERT')
+
+slow_log = logging.getLogger('slow_queries')
+
+class Histogram:
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * len(BUCKETS_MS)
+
+    def add(self, ms):
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        for index, bound in enumerate(BUCKETS_MS):
+            if ms <= bound:
+                self.buckets[index] += 1
+                break
+
+    # Upper bound of the bucket holding the given fraction of samples
+    def percentile(self, fraction):
+        target = self.count * fraction
+        seen = 0
+        for bound, count in zip(BUCKETS_MS, self.buckets):
+            seen += count
+            if seen >= target and count:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'total_ms': self.total_ms,
+            'mean_ms': self.total_ms / self.count if self.count else 0,
+            'max_ms': self.max_ms,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'buckets': {('inf' if bound == float('inf') else str(bound)): count
+                        for bound, count in zip(BUCKETS_MS, self.buckets)},
+        }
+
+# Per-statement latency and row counts, plus time spent waiting for a pooled
+# connection. Shared by every InstrumentedCursor in the process
+class QueryStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.statements = {}
+        self.rows = {}
+        self.connection_wait = Histogram()
+
+    def record(self, key, ms, rows):
+        with self.lock:
+            self.statements.setdefault(key, Histogram()).add(ms)
+            if rows > 0:
+                self.rows[key] = self.rows.get(key, 0) + rows
+
+    def add_rows(self, key, rows):
+        with self.lock:
+            self.rows[key] = self.rows.get(key, 0) + rows
+
+    def record_wait(self, ms):
+        with self.lock:
+            self.connection_wait.add(ms)
+
+    def snapshot(self):
+        with self.lock:
+            statements = {}
+            for key, histogram in self.statements.items():
+                statements[key] = dict(histogram.as_dict(), rows=self.rows.get(key, 0))
+            return {
+                'pid': os.getpid(),
+                'dumped_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'statements': statements,
+                'connection_wait': self.connection_wait.as_dict(),
+            }
+
+    def reset(self):
+        with self.lock:
+            self.statements = {}
+            self.rows = {}
+            self.connection_wait = Histogram()
+
+stats = QueryStats()
+
+def statement_key(query):
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', errors='replace')
+    query = ' '.join(str(query).split())
+    match = re.match(r'(?i)(EXECUTE|PREPARE|COPY)\s+(\w+)', query)
+    if match:
+        return f"{match.group(1).upper()} {match.group(2)}"
+    return query[:100]
+
+def explain(conn, query, params):
+    # A plain cursor, so the EXPLAIN is not itself instrumented. Inside a
+    # transaction it runs under a savepoint, so a failure cannot abort the caller's work
+    cur = psycopg2.extensions.cursor(conn)
+    in_transaction = not conn.autocommit
+    try:
+        if in_transaction:
+            cur.execute("SAVEPOINT instrument_explain")
+        cur.execute(f"EXPLAIN {query}", params)
+        plan = '\n'.join(row[0] for row in cur.fetchall())
+        if in_transaction:
+            cur.execute("RELEASE SAVEPOINT instrument_explain")
+        return plan
+    except psycopg2.Error as error:
+        if in_transaction:
+            cur.execute("ROLLBACK TO SAVEPOINT instrument_explain")
+        return f"(EXPLAIN failed: {error})"
+    finally:
+        cur.close()
+
+def log_slow_query(conn, query, params, ms):
+    text = query.decode('utf-8', errors='replace') if isinstance(query, bytes) else str(query)
+    plan = ''
+    # EXPLAIN only covers the first of several statements and runs the rest,
+    # so text with a ';' before its end is never explained
+    single = ';' not in text.strip().rstrip(';')
+    if single and text.lstrip().upper().startswith(EXPLAINABLE) and len(text) <= SLOW_QUERY_TEXT:
+        plan = explain(conn, text, params)
+    # Batched inserts inline thousands of rows; the head of the statement is enough to find it
+    slow_log.warning("%.1f ms: %s\nparams: %r\n%s", ms, ' '.join(text.split())[:SLOW_QUERY_TEXT], params, plan)
+
+# Cursor that times every statement. Used as the cursor_factory of the UI's
+# pooled connections and of the loader's connection
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        return self.timed(query, vars, super().execute, query, vars)
+
+    def executemany(self, query, vars_list):
+        return self.timed(query, None, super().executemany, query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        return self.timed(sql, None, super().copy_expert, sql, file, size)
+
+    # Server-side cursors only know their row count as rows are fetched
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(size) if size is not None else super().fetchmany()
+        if self.name:
+            stats.add_rows(self.last_key, len(rows))
+        return rows
+
+    def timed(self, query, params, call, *args):
+        self.last_key = statement_key(query)
+        started = time.perf_counter()
+        try:
+            result = call(*args)
+        except psycopg2.Error:
+            stats.record(self.last_key, (time.perf_counter() - started) * 1000, 0)
+            raise
+        ms = (time.perf_counter() - started) * 1000
+        stats.record(self.last_key, ms, self.rowcount)
+        # Only successful statements are explained; after an error the transaction is aborted
+        if ms >= SLOW_QUERY_MS:
+            log_slow_query(self.connection, query, params, ms)
+        return result
+
+def dump_stats(path=STATS_FILE):
+    snapshot = stats.snapshot()
+    with open(path, 'w') as f:
+        json.dump(snapshot, f, indent=2)
+    return path
+
+# Writes the stats at exit and whenever the process receives SIGUSR1, and
+# sends slow queries to SLOW_QUERY_LOG
+def install(stats_file=STATS_FILE):
+    if not slow_log.handlers:
+        handler = logging.FileHandler(SLOW_QUERY_LOG)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        slow_log.addHandler(handler)
+    atexit.register(dump_stats, stats_file)
+    if hasattr(signal, 'SIGUSR1') and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR1, lambda signum, frame: dump_stats(stats_file))
+
+def print_stats(snapshot, sort='total_ms', limit=None):
+    statements = sorted(snapshot['statements'].items(), key=lambda item: item[1][sort], reverse=True)
+    print(f"Query stats for pid {snapshot['pid']} at {snapshot['dumped_at']}")
+    print(f"{'statement':<50} {'calls':>7} {'total ms':>10} {'mean':>8} {'p50':>8} {'p95':>8} {'p99':>8} "
+          f"{'max':>8} {'rows':>9}")
+    for key, entry in statements[:limit]:
+        print(f"{key[:50]:<50} {entry['count']:>7} {entry['total_ms']:>10.1f} {entry['mean_ms']:>8.1f} "
+              f"{entry['p50_ms']:>8.1f} {entry['p95_ms']:>8.1f} {entry['p99_ms']:>8.1f} {entry['max_ms']:>8.1f} "
+              f"{entry['rows']:>9}")
+    wait = snapshot['connection_wait']
+    if wait['count']:
+        print(f"\nConnection wait: {wait['count']} checkouts, mean {wait['mean_ms']:.2f} ms, "
+              f"p95 {wait['p95_ms']:.1f} ms, max {wait['max_ms']:.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Show query stats dumped by the UI or the loader")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    dump = subparsers.add_parser('dump-stats', help="print a stats file as a table")
+    dump.add_argument('file', nargs='?', default=STATS_FILE, help=f"stats file (default {STATS_FILE})")
+    dump.add_argument('--pid', type=int, help="first ask a running process to dump its stats (SIGUSR1)")
+    dump.add_argument('--sort', default='total_ms', choices=['total_ms', 'mean_ms', 'p95_ms', 'max_ms', 'count'])
+    dump.add_argument('--limit', type=int, help="only show the top N statements")
+    args = parser.parse_args()
+
+    if args.pid:
+        os.kill(args.pid, signal.SIGUSR1)
+        time.sleep(0.5)
+    with open(args.file) as f:
+        print_stats(json.load(f), args.sort, args.limit)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import argparse
+import os
+import re
+from Ryan_and_Stef_Parser_v3 import connect_to_db
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+MIGRATION_FILE = re.compile(r'^V(\d+)__(\w+)\.sql$')
+
+# Migrations are migrations/V<version>__<name>.sql, applied in version order,
+# each in its own transaction, and recorded in SchemaVersion
+def list_migrations():
+    migrations = []
+    for file_name in os.listdir(MIGRATIONS_DIR):
+        match = MIGRATION_FILE.match(file_name)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, file_name)))
+    return sorted(migrations)
+
+def applied_versions(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS SchemaVersion (
+            version     INTEGER PRIMARY KEY,
+            name        TEXT NOT NULL,
+            applied_at  TIMESTAMP DEFAULT now()
+        );
+    """)
+    cur.execute("SELECT version FROM SchemaVersion;")
+    return {row[0] for row in cur.fetchall()}
+
+def migrate(conn, target=None, dry_run=False):
+    cur = conn.cursor()
+    applied = applied_versions(cur)
+    conn.commit()
+    for version, name, path in list_migrations():
+        if version in applied or (target is not None and version > target):
+            continue
+        print(f"Applying V{version:03d} {name}")
+        if dry_run:
+            continue
+        with open(path) as f:
+            cur.execute(f.read())
+        cur.execute("INSERT INTO SchemaVersion (version, name) VALUES (%s, %s);", (version, name))
+        conn.commit()
+    cur.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations")
+    parser.add_argument('--target', type=int, help="stop after this migration version")
+    parser.add_argument('--dry-run', action='store_true', help="list pending migrations without applying them")
+    args = parser.parse_args()
+    conn = connect_to_db()
+    if conn is None:
+        return
+    try:
+        migrate(conn, args.target, args.dry_run)
+    except Exception as e:
+        print(f"Migration failed: {e}")
+        conn.rollback()
+        raise SystemExit(1)
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
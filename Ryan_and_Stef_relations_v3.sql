@@ -55,6 +55,55 @@ CREATE TABLE IF NOT EXISTS BusinessCategory (
     FOREIGN KEY (category_id) REFERENCES Category (category_id) ON DELETE CASCADE
 );
 
+CREATE TABLE IF NOT EXISTS LoadProgress (
+    file_name      TEXT PRIMARY KEY,
+    byte_offset    BIGINT NOT NULL DEFAULT 0,
+    line_number    BIGINT NOT NULL DEFAULT 0,
+    completed      BOOLEAN NOT NULL DEFAULT FALSE,
+    updated_at     TIMESTAMP DEFAULT now()
+);
+
+-- Single-row counter bumped by the loader after every ingestion. Clients stamp
+-- their caches with it so they can tell when the data has changed
+CREATE TABLE IF NOT EXISTS DataGeneration (
+    id             BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    generation     BIGINT NOT NULL DEFAULT 0,
+    updated_at     TIMESTAMP DEFAULT now()
+);
+INSERT INTO DataGeneration DEFAULT VALUES ON CONFLICT DO NOTHING;
+
+-- Per-business summary read by the UI result panels. Review and CheckIn are
+-- aggregated separately before joining, so neither multiplies the other.
+-- Refreshed by the loader, or with: python Ryan_and_Stef_Parser_v3.py --refresh-summary
+CREATE MATERIALIZED VIEW IF NOT EXISTS BusinessSummary AS
+SELECT
+    b.business_id,
+    COALESCE(r.review_count, 0) AS review_count,
+    r.avg_review_stars,
+    r.first_review_date,
+    COALESCE(ci.total_checkins, 0) AS total_checkins,
+    COALESCE(cat.categories, '') AS categories
+FROM Business b
+LEFT JOIN (
+    SELECT business_id, COUNT(*) AS review_count, AVG(stars) AS avg_review_stars, MIN(date) AS first_review_date
+    FROM Review
+    GROUP BY business_id
+) r ON r.business_id = b.business_id
+LEFT JOIN (
+    SELECT business_id, SUM(num_checkins) AS total_checkins
+    FROM CheckIn
+    GROUP BY business_id
+) ci ON ci.business_id = b.business_id
+LEFT JOIN (
+    SELECT bc.business_id, string_agg(c.name, ', ' ORDER BY c.name) AS categories
+    FROM BusinessCategory bc
+    JOIN Category c ON c.category_id = bc.category_id
+    GROUP BY bc.business_id
+) cat ON cat.business_id = b.business_id;
+
+-- Required by REFRESH MATERIALIZED VIEW CONCURRENTLY
+CREATE UNIQUE INDEX IF NOT EXISTS businesssummary_business_id ON BusinessSummary (business_id);
+
 
 -- Example: Filtering businesses in a specific city and category
 SELECT 
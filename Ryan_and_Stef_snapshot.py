@@ -0,0 +1,314 @@
+import argparse
+import bisect
+import json
+import mmap
+import os
+import struct
+import time
+import numpy as np
+import psycopg2
+import Ryan_and_Stef_Service as service
+
+# File layout: MAGIC, format version and header length, a JSON header naming
+# every array with its dtype, shape and offset, then the arrays themselves,
+# each aligned so it can be viewed in place from the memory map
+MAGIC = b'YELPSNAP'
+VERSION = 1
+PREAMBLE = struct.Struct('<8sII')
+ALIGNMENT = 64
+
+EXPORT_BUSINESSES = """
+    SELECT b.business_id, b.name, COALESCE(b.address, ''), b.state, b.city, b.zipcode, b.stars,
+           s.review_count, s.avg_review_stars, s.total_checkins
+    FROM Business b
+    JOIN BusinessSummary s ON s.business_id = b.business_id
+    WHERE b.state IS NOT NULL AND b.city IS NOT NULL AND b.zipcode IS NOT NULL
+"""
+EXPORT_CATEGORIES = """
+    SELECT bc.business_id, c.name
+    FROM BusinessCategory bc
+    JOIN Category c ON c.category_id = bc.category_id
+"""
+EXPORT_ZIPCODE_STATS = "SELECT zipcode, medianIncome, meanIncome, population FROM ZipcodeStats"
+# Stored in place of a NULL income or population
+MISSING = -1
+
+def string_table(values):
+    encoded = [value.encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(np.array([len(value) for value in encoded], dtype=np.int64), out=offsets[1:])
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return data, offsets
+
+# Gathers the aggregates into arrays. Businesses are ordered by location and
+# then by (name, business_id), so a state/city/zipcode filter is one
+# contiguous range and each page continues from a binary search
+def build_arrays(businesses, business_categories, zipcode_stats):
+    businesses.sort(key=lambda row: (row[3], row[4], row[5], row[1], row[0]))
+    locations = sorted({(row[3], row[4], row[5]) for row in businesses})
+    location_index = {location: index for index, location in enumerate(locations)}
+    business_index = {row[0]: index for index, row in enumerate(businesses)}
+    business_location = np.array([location_index[(row[3], row[4], row[5])] for row in businesses], dtype=np.int32)
+
+    categories = sorted({name for _, name in business_categories})
+    category_index = {name: index for index, name in enumerate(categories)}
+    pairs = sorted((business_index[business_id], category_index[name])
+                   for business_id, name in business_categories if business_id in business_index)
+    pair_businesses = np.array([business for business, _ in pairs], dtype=np.int32)
+    pair_categories = np.array([category for _, category in pairs], dtype=np.int32)
+    # The same pairs twice: categories of each business, and businesses of each category
+    by_category = np.lexsort((pair_businesses, pair_categories))
+
+    zipcode_stats.sort()
+    arrays = {
+        'business_location': business_location,
+        'location_start': np.searchsorted(business_location, np.arange(len(locations) + 1)).astype(np.int64),
+        'stars': np.array([row[6] or 0 for row in businesses], dtype=np.float32),
+        'review_count': np.array([row[7] for row in businesses], dtype=np.int32),
+        'avg_review_stars': np.array([np.nan if row[8] is None else row[8] for row in businesses], dtype=np.float32),
+        'total_checkins': np.array([row[9] for row in businesses], dtype=np.int64),
+        'business_category_start': np.searchsorted(pair_businesses, np.arange(len(businesses) + 1)).astype(np.int64),
+        'business_categories': pair_categories,
+        'category_start': np.searchsorted(pair_categories[by_category], np.arange(len(categories) + 1)).astype(np.int64),
+        'category_businesses': pair_businesses[by_category],
+        'median_income': np.array([MISSING if row[1] is None else row[1] for row in zipcode_stats], dtype=np.int64),
+        'mean_income': np.array([MISSING if row[2] is None else row[2] for row in zipcode_stats], dtype=np.int64),
+        'population': np.array([MISSING if row[3] is None else row[3] for row in zipcode_stats], dtype=np.int64),
+    }
+    strings = {
+        'business_id': [row[0] for row in businesses],
+        'name': [row[1] for row in businesses],
+        'address': [row[2] for row in businesses],
+        'state': [state for state, _, _ in locations],
+        'city': [city for _, city, _ in locations],
+        'zipcode': [zipcode for _, _, zipcode in locations],
+        'category': categories,
+        'stats_zipcode': [row[0] for row in zipcode_stats],
+    }
+    for name, values in strings.items():
+        arrays[name + '.data'], arrays[name + '.offsets'] = string_table(values)
+    return arrays
+
+def write_snapshot(path, arrays, generation):
+    entries = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        entries[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += array.nbytes
+    header = json.dumps({
+        'generation': generation,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'arrays': entries,
+    }).encode('utf-8')
+    data_start = -(-(PREAMBLE.size + len(header)) // ALIGNMENT) * ALIGNMENT
+
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(PREAMBLE.pack(MAGIC, VERSION, len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + entries[name]['offset'])
+            f.write(np.ascontiguousarray(array).tobytes())
+    os.replace(temp_path, path)
+    return data_start + offset
+
+def export_snapshot(conn, path):
+    with conn.cursor() as cur:
+        cur.execute("SELECT generation FROM DataGeneration;")
+        generation = cur.fetchone()[0]
+        cur.execute(EXPORT_BUSINESSES)
+        businesses = cur.fetchall()
+        cur.execute(EXPORT_CATEGORIES)
+        business_categories = cur.fetchall()
+        cur.execute(EXPORT_ZIPCODE_STATS)
+        zipcode_stats = cur.fetchall()
+    size = write_snapshot(path, build_arrays(businesses, business_categories, zipcode_stats), generation)
+    print(f"Wrote {len(businesses)} businesses, {len(business_categories)} categories and "
+          f"{len(zipcode_stats)} zipcode stats to {path} ({size / 1e6:.1f} MB, generation {generation})")
+
+class StringTable:
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return self.data[self.offsets[index]:self.offsets[index + 1]].tobytes().decode('utf-8')
+
+    # Position of value in a sorted table, or -1
+    def find(self, value):
+        index = bisect.bisect_left(self, value, 0, len(self))
+        return index if index < len(self) and self[index] == value else -1
+
+# Read-only view of a snapshot file. Arrays are views into the memory map, so
+# only the pages a lookup touches are read. Offers the location, zipcode and
+# business search functions of Ryan_and_Stef_Service with the same results
+class Snapshot:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, header_length = PREAMBLE.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a snapshot file")
+        if version != VERSION:
+            raise ValueError(f"{path} is snapshot version {version}, expected {VERSION}")
+        header = json.loads(self.map[PREAMBLE.size:PREAMBLE.size + header_length])
+        self.generation = header['generation']
+        self.created_at = header['created_at']
+        data_start = -(-(PREAMBLE.size + header_length) // ALIGNMENT) * ALIGNMENT
+        self.arrays = {}
+        for name, entry in header['arrays'].items():
+            dtype = np.dtype(entry['dtype'])
+            count = int(np.prod(entry['shape']))
+            if not count:
+                # Empty arrays may sit past the end of the file
+                self.arrays[name] = np.zeros(0, dtype)
+                continue
+            self.arrays[name] = np.frombuffer(self.map, dtype, count, data_start + entry['offset'])
+        self.strings = {}
+        for name in self.arrays:
+            if name.endswith('.offsets'):
+                table = name[:-len('.offsets')]
+                self.strings[table] = StringTable(self.arrays[table + '.data'], self.arrays[name])
+
+        # The location tree is small, so it is decoded once
+        self.states = {}
+        self.zipcode_locations = {}
+        self.location_index = {}
+        for index in range(len(self.strings['state'])):
+            state, city, zipcode = (self.strings[name][index] for name in ('state', 'city', 'zipcode'))
+            self.states.setdefault(state, {}).setdefault(city, []).append(zipcode)
+            self.zipcode_locations.setdefault(zipcode, []).append(index)
+            self.location_index[(state, city, zipcode)] = index
+
+    def load_locations(self):
+        return self.list_states()
+
+    def list_states(self):
+        return sorted(self.states)
+
+    def list_cities(self, state):
+        return sorted(self.states.get(state, {}))
+
+    def list_zipcodes(self, state, city):
+        return self.states.get(state, {}).get(city, [])
+
+    def location_range(self, state, city, zipcode):
+        index = self.location_index.get((state, city, zipcode))
+        if index is None:
+            return 0, 0
+        start = self.arrays['location_start']
+        return int(start[index]), int(start[index + 1])
+
+    def zipcode_ranges(self, zipcode):
+        start = self.arrays['location_start']
+        return [(int(start[index]), int(start[index + 1])) for index in self.zipcode_locations.get(zipcode, [])]
+
+    # Businesses in a location, optionally in a category, as an index array in display order
+    def matching_businesses(self, city, state, zipcode, category=None):
+        low, high = self.location_range(state, city, zipcode)
+        if not category:
+            return np.arange(low, high)
+        category_id = self.strings['category'].find(category)
+        if category_id < 0:
+            return np.arange(0)
+        category_start = self.arrays['category_start']
+        members = self.arrays['category_businesses'][category_start[category_id]:category_start[category_id + 1]]
+        return members[np.searchsorted(members, low):np.searchsorted(members, high)]
+
+    def business_key(self, index):
+        return (self.strings['name'][index], self.strings['business_id'][index])
+
+    def business_row(self, index, city):
+        avg_review_stars = float(self.arrays['avg_review_stars'][index])
+        return (self.strings['name'][index],
+                f"{self.strings['address'][index]}, {city}",
+                city,
+                round(float(self.arrays['stars'][index]), 1),
+                int(self.arrays['review_count'][index]),
+                0 if np.isnan(avg_review_stars) else round(avg_review_stars, 1),
+                int(self.arrays['total_checkins'][index]),
+                self.strings['business_id'][index])
+
+    def list_businesses(self, city, state, zipcode, category=None, after=None, limit=service.PAGE_SIZE):
+        indexes = self.matching_businesses(city, state, zipcode, category)
+        start = 0
+        if after:
+            start = bisect.bisect_right(indexes, tuple(after), key=self.business_key)
+        return [self.business_row(int(index), city) for index in indexes[start:start + limit]]
+
+    def stream_businesses(self, city, state, zipcode, batch_size=service.STREAM_BATCH_SIZE):
+        indexes = self.matching_businesses(city, state, zipcode)
+        for start in range(0, len(indexes), batch_size):
+            yield [self.business_row(int(index), city) for index in indexes[start:start + batch_size]]
+
+    def count_businesses(self, city, state, zipcode, category=None):
+        return len(self.matching_businesses(city, state, zipcode, category))
+
+    # Category ids of every business in the zipcode, one per business/category pair
+    def zipcode_categories(self, zipcode):
+        business_category_start = self.arrays['business_category_start']
+        business_categories = self.arrays['business_categories']
+        ranges = [business_categories[business_category_start[low]:business_category_start[high]]
+                  for low, high in self.zipcode_ranges(zipcode)]
+        return np.concatenate(ranges) if ranges else np.zeros(0, dtype=np.int32)
+
+    def list_categories(self, zipcode):
+        return [(self.strings['category'][int(index)],) for index in np.unique(self.zipcode_categories(zipcode))]
+
+    def list_top_categories(self, zipcode, min_count=5):
+        counts = np.bincount(self.zipcode_categories(zipcode), minlength=len(self.strings['category']))
+        top = np.flatnonzero(counts >= max(min_count, 1))
+        top = top[np.argsort(-counts[top], kind='stable')]
+        return [(self.strings['category'][int(index)], int(counts[index])) for index in top]
+
+    def list_zipcode_stats(self, zipcode):
+        num_businesses = sum(high - low for low, high in self.zipcode_ranges(zipcode))
+        if not num_businesses:
+            return None
+        median_income = mean_income = population = None
+        index = self.strings['stats_zipcode'].find(zipcode)
+        if index >= 0:
+            median_income, mean_income, population = (
+                None if self.arrays[name][index] == MISSING else int(self.arrays[name][index])
+                for name in ('median_income', 'mean_income', 'population'))
+        return (zipcode, num_businesses, median_income, mean_income, population)
+
+    # Same shape as Ryan_and_Stef_Service.zipcode_overview; every lookup is in memory
+    async def zipcode_overview(self, zipcode, min_count=5):
+        return {
+            'stats': self.list_zipcode_stats(zipcode),
+            'categories': self.list_categories(zipcode),
+            'top_categories': self.list_top_categories(zipcode, min_count),
+        }
+
+def describe(snapshot, path):
+    print(f"{path}: version {VERSION}, generation {snapshot.generation}, created {snapshot.created_at}")
+    print(f"{len(snapshot.strings['business_id'])} businesses, {len(snapshot.strings['state'])} locations, "
+          f"{len(snapshot.strings['category'])} categories, {len(snapshot.strings['stats_zipcode'])} zipcode stats")
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or inspect a memory-mapped snapshot for the UI")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export = subparsers.add_parser('export', help="write a snapshot from the database")
+    export.add_argument('file', help="snapshot file to write")
+    export.add_argument('--database', default=service.DB_SETTINGS['database'], help="database to export")
+    info = subparsers.add_parser('info', help="describe a snapshot file")
+    info.add_argument('file')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        service.DB_SETTINGS['database'] = args.database
+        conn = psycopg2.connect(**service.DB_SETTINGS)
+        try:
+            export_snapshot(conn, args.file)
+        finally:
+            conn.close()
+    else:
+        describe(Snapshot(args.file), args.file)
+
+if __name__ == "__main__":
+    main()
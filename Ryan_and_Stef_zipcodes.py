@@ -0,0 +1,203 @@
+import argparse
+import csv
+import re
+import time
+import psycopg2
+import psycopg2.errors
+import Ryan_and_Stef_Parser_v3 as loader
+
+ZIPCODE_COLUMNS = ('zipcode', 'medianIncome', 'meanIncome', 'population')
+STAGING_TABLE = 'ZipcodeStats_staging'
+# One row of the legacy import_zipdata.sql INSERT: ('1001',56663,66688,16445)
+SQL_TUPLE = re.compile(r"\(\s*'([^']*)'\s*,\s*(-?\d+|NULL)\s*,\s*(-?\d+|NULL)\s*,\s*(-?\d+|NULL)\s*\)",
+                       re.IGNORECASE)
+MISSING_VALUES = {'', '-', 'N/A', 'NULL'}
+# The rename needs an exclusive lock. Queueing for it behind a long query would
+# also queue every UI reader, so the swap gives up quickly and tries again
+SWAP_LOCK_TIMEOUT = '2s'
+SWAP_ATTEMPTS = 5
+REJECT_EXAMPLES = 5
+
+# Business zipcodes with no ZipcodeStats row, split into five-digit US zipcodes
+# and everything else (Canadian postal codes, typos)
+UNMATCHED_ZIPCODES_SQL = """
+    SELECT b.zipcode ~ '^[0-9]{5}$', COUNT(DISTINCT b.zipcode), COUNT(*)
+    FROM Business b
+    WHERE b.zipcode IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM ZipcodeStats zs WHERE zs.zipcode = b.zipcode)
+    GROUP BY 1
+"""
+UNMATCHED_EXAMPLES_SQL = """
+    SELECT b.zipcode, COUNT(*)
+    FROM Business b
+    WHERE b.zipcode ~ '^[0-9]{5}$'
+      AND NOT EXISTS (SELECT 1 FROM ZipcodeStats zs WHERE zs.zipcode = b.zipcode)
+    GROUP BY b.zipcode
+    ORDER BY COUNT(*) DESC, b.zipcode
+    LIMIT %s
+"""
+
+# Census files drop leading zeros ('1001'); Business keeps them ('01001')
+def normalize_zipcode(value):
+    # ZIP+4 codes keep their first five digits
+    value = value.strip().split('-')[0]
+    if not value.isdigit() or len(value) > 5:
+        raise ValueError(f"not a US zipcode: {value!r}")
+    return value.zfill(5)
+
+def parse_count(value):
+    value = value.strip().replace(',', '')
+    return None if value.upper() in MISSING_VALUES else int(value)
+
+# CSV with a zipcode, medianIncome, meanIncome, population header (any order
+# and case), or with no header and the columns in that order
+def read_csv(path):
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        first = next(reader, None)
+        if first is None:
+            return
+        names = [name.strip().lower() for name in first]
+        if 'zipcode' in names:
+            missing = [column for column in ZIPCODE_COLUMNS if column.lower() not in names]
+            if missing:
+                raise ValueError(f"{path} has no {', '.join(missing)} column")
+            positions = [names.index(column.lower()) for column in ZIPCODE_COLUMNS]
+        else:
+            positions = list(range(len(ZIPCODE_COLUMNS)))
+            yield "line 1", first
+        for line_number, values in enumerate(reader, start=2):
+            if values:
+                yield f"line {line_number}", [values[position] if position < len(values) else None
+                                              for position in positions]
+
+def read_sql(path):
+    with open(path) as f:
+        text = f.read()
+    for number, match in enumerate(SQL_TUPLE.finditer(text), start=1):
+        yield f"row {number}", match.groups()
+
+# Rows ready for COPY, keyed by padded zipcode so a later duplicate replaces an
+# earlier one, plus the records that could not be read
+def normalize(records):
+    rows = {}
+    rejected = []
+    duplicates = 0
+    for location, values in records:
+        try:
+            if len(values) < len(ZIPCODE_COLUMNS) or None in values:
+                raise ValueError(f"expected {len(ZIPCODE_COLUMNS)} columns")
+            zipcode = normalize_zipcode(values[0])
+            row = (zipcode, *(parse_count(value) for value in values[1:len(ZIPCODE_COLUMNS)]))
+        except ValueError as error:
+            rejected.append((location, error))
+            continue
+        if zipcode in rows:
+            duplicates += 1
+        rows[zipcode] = row
+    return list(rows.values()), rejected, duplicates
+
+# The new data goes into its own table, with the primary key built after the
+# COPY, while the UI keeps reading the current ZipcodeStats
+def load_staging(conn, cur, rows):
+    started = time.perf_counter()
+    cur.execute(f"DROP TABLE IF EXISTS {STAGING_TABLE};")
+    cur.execute(f"""
+        CREATE TABLE {STAGING_TABLE} (
+            zipcode VARCHAR(5) NOT NULL CONSTRAINT zipcodestats_zipcode_format CHECK (zipcode ~ '^[0-9]{{5}}$'),
+            medianIncome INT,
+            meanIncome INT,
+            population INT
+        );
+    """)
+    loader.copy_rows(cur, STAGING_TABLE, rows, ZIPCODE_COLUMNS)
+    cur.execute(f"ALTER TABLE {STAGING_TABLE} ADD CONSTRAINT zipcodestats_staging_pkey PRIMARY KEY (zipcode);")
+    cur.execute(f"ANALYZE {STAGING_TABLE};")
+    conn.commit()
+    print(f"Loaded {len(rows)} rows into {STAGING_TABLE} in {time.perf_counter() - started:.1f}s")
+
+# Replaces ZipcodeStats with the staging table in one transaction. Readers see
+# either the old table or the new one; prepared statements are replanned
+# against the new table on their next run
+def swap_in(conn, cur):
+    for attempt in range(1, SWAP_ATTEMPTS + 1):
+        try:
+            cur.execute(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}';")
+            cur.execute("ALTER TABLE IF EXISTS ZipcodeStats RENAME TO ZipcodeStats_old;")
+            cur.execute(f"ALTER TABLE {STAGING_TABLE} RENAME TO ZipcodeStats;")
+            cur.execute("DROP TABLE IF EXISTS ZipcodeStats_old;")
+            cur.execute("ALTER TABLE ZipcodeStats RENAME CONSTRAINT zipcodestats_staging_pkey TO zipcodestats_pkey;")
+            loader.bump_generation(cur)
+            conn.commit()
+            print("Swapped in the new ZipcodeStats")
+            return
+        except psycopg2.errors.LockNotAvailable:
+            conn.rollback()
+            print(f"ZipcodeStats is in use, retrying the swap ({attempt}/{SWAP_ATTEMPTS})")
+            time.sleep(attempt)
+    raise RuntimeError(f"could not lock ZipcodeStats; the new data is still in {STAGING_TABLE}")
+
+def report_unmatched(cur, examples=10):
+    cur.execute(UNMATCHED_ZIPCODES_SQL)
+    counts = {us_format: (zipcodes, businesses) for us_format, zipcodes, businesses in cur.fetchall()}
+    zipcodes, businesses = counts.get(True, (0, 0))
+    print(f"{zipcodes} Business zipcodes ({businesses} businesses) have no ZipcodeStats row")
+    other_zipcodes, other_businesses = counts.get(False, (0, 0))
+    if other_zipcodes:
+        print(f"{other_zipcodes} more ({other_businesses} businesses) are not five-digit US zipcodes")
+    if zipcodes and examples:
+        cur.execute(UNMATCHED_EXAMPLES_SQL, (examples,))
+        print("Most businesses: " + ', '.join(f"{zipcode} ({count})" for zipcode, count in cur.fetchall()))
+    return counts
+
+def load(conn, path, file_format, examples):
+    if file_format == 'auto':
+        file_format = 'sql' if path.lower().endswith('.sql') else 'csv'
+    rows, rejected, duplicates = normalize(read_sql(path) if file_format == 'sql' else read_csv(path))
+    print(f"Read {len(rows)} zipcodes from {path} ({len(rejected)} rejected, {duplicates} duplicates)")
+    for location, error in rejected[:REJECT_EXAMPLES]:
+        print(f"  {location}: {error}")
+    if not rows:
+        raise ValueError(f"no zipcodes in {path}; ZipcodeStats left as it was")
+    cur = conn.cursor()
+    try:
+        load_staging(conn, cur, rows)
+        swap_in(conn, cur)
+        report_unmatched(cur, examples)
+    finally:
+        cur.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Load census data into ZipcodeStats and check it against Business")
+    parser.add_argument('--database', default=loader.DB_SETTINGS['database'], help="database to use")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    load_parser = subparsers.add_parser('load', help="replace ZipcodeStats with the rows of a CSV or SQL file")
+    load_parser.add_argument('file', help="CSV of zipcode, medianIncome, meanIncome, population, "
+                                          "or the legacy import_zipdata.sql")
+    load_parser.add_argument('--format', choices=['auto', 'csv', 'sql'], default='auto',
+                             help="input format; auto goes by the file extension (default auto)")
+    load_parser.add_argument('--examples', type=int, default=10,
+                             help="unmatched zipcodes listed after the load (default 10)")
+    report_parser = subparsers.add_parser('report', help="count Business zipcodes without a ZipcodeStats row")
+    report_parser.add_argument('--examples', type=int, default=10, help="unmatched zipcodes listed (default 10)")
+    args = parser.parse_args()
+
+    loader.DB_SETTINGS['database'] = args.database
+    conn = loader.connect_to_db()
+    if conn is None:
+        return
+    try:
+        if args.command == 'load':
+            load(conn, args.file, args.format, args.examples)
+        else:
+            with conn.cursor() as cur:
+                report_unmatched(cur, args.examples)
+    except (ValueError, RuntimeError, OSError, psycopg2.Error) as e:
+        print(f"Zipcode load failed: {e}")
+        conn.rollback()
+        raise SystemExit(1)
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+-- Indexes for the filters the UI runs on every click. Without them each
+-- state/city/zipcode lookup is a sequential scan of Business.
+
+-- list_businesses filters on all three; list_locations reads it in order
+CREATE INDEX IF NOT EXISTS business_state_city_zipcode ON Business (state, city, zipcode);
+
+-- Zipcode panels (categories, top categories, stats, popular, successful)
+CREATE INDEX IF NOT EXISTS business_zipcode ON Business (zipcode);
+
+-- Category -> businesses; the primary key only covers business_id first
+CREATE INDEX IF NOT EXISTS businesscategory_category_id ON BusinessCategory (category_id);
+
+-- The Review primary key leads with review_id, so it cannot serve lookups by
+-- business. CheckIn's primary key already leads with business_id.
+CREATE INDEX IF NOT EXISTS review_business_id ON Review (business_id);
+
+ANALYZE Business;
+ANALYZE BusinessCategory;
+ANALYZE Review;
@@ -0,0 +1,61 @@
+-- Checkins as one row per business: a 168-slot array indexed by
+-- day * 24 + hour (Monday = day 0) and the precomputed total. Filled by the
+-- loader with --checkin-storage histogram or both.
+CREATE TABLE IF NOT EXISTS CheckInHistogram (
+    business_id     TEXT PRIMARY KEY,
+    hours           INTEGER[] NOT NULL CHECK (cardinality(hours) = 168),
+    total_checkins  INTEGER NOT NULL,
+    FOREIGN KEY (business_id) REFERENCES Business (business_id) ON DELETE CASCADE
+);
+
+-- Backfill from any CheckIn rows already loaded
+WITH slots AS (
+    SELECT business_id,
+           (array_position(ARRAY['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'],
+                           day) - 1) * 24 + EXTRACT(HOUR FROM time)::int AS slot,
+           SUM(num_checkins) AS num_checkins
+    FROM CheckIn
+    GROUP BY 1, 2
+)
+INSERT INTO CheckInHistogram (business_id, hours, total_checkins)
+SELECT b.business_id, array_agg(COALESCE(s.num_checkins, 0)::int ORDER BY g.slot), COALESCE(SUM(s.num_checkins), 0)
+FROM (SELECT DISTINCT business_id FROM slots) b
+CROSS JOIN generate_series(0, 167) AS g(slot)
+LEFT JOIN slots s ON s.business_id = b.business_id AND s.slot = g.slot
+GROUP BY b.business_id
+ON CONFLICT (business_id) DO NOTHING;
+
+-- BusinessSummary takes checkin totals from the histogram when a business has
+-- one, so the UI panels no longer sum up to 168 CheckIn rows per business
+DROP MATERIALIZED VIEW IF EXISTS BusinessSummary;
+CREATE MATERIALIZED VIEW BusinessSummary AS
+SELECT
+    b.business_id,
+    COALESCE(r.review_count, 0) AS review_count,
+    r.avg_review_stars,
+    r.first_review_date,
+    COALESCE(h.total_checkins, ci.total_checkins, 0) AS total_checkins,
+    COALESCE(cat.categories, '') AS categories
+FROM Business b
+LEFT JOIN (
+    SELECT business_id, COUNT(*) AS review_count, AVG(stars) AS avg_review_stars, MIN(date) AS first_review_date
+    FROM Review
+    GROUP BY business_id
+) r ON r.business_id = b.business_id
+LEFT JOIN CheckInHistogram h ON h.business_id = b.business_id
+LEFT JOIN (
+    SELECT business_id, SUM(num_checkins) AS total_checkins
+    FROM CheckIn
+    WHERE business_id NOT IN (SELECT business_id FROM CheckInHistogram)
+    GROUP BY business_id
+) ci ON ci.business_id = b.business_id
+LEFT JOIN (
+    SELECT bc.business_id, string_agg(c.name, ', ' ORDER BY c.name) AS categories
+    FROM BusinessCategory bc
+    JOIN Category c ON c.category_id = bc.category_id
+    GROUP BY bc.business_id
+) cat ON cat.business_id = b.business_id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS businesssummary_business_id ON BusinessSummary (business_id);
+
+ANALYZE CheckInHistogram;
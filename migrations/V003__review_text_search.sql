@@ -0,0 +1,10 @@
+-- Full-text search over review text. The tsvector is a stored generated
+-- column, so every load path (COPY, per-row INSERT) fills it without loader
+-- changes, and the GIN index answers the UI's review search without scanning text.
+ALTER TABLE Review
+    ADD COLUMN IF NOT EXISTS text_search tsvector
+    GENERATED ALWAYS AS (to_tsvector('english', COALESCE(text, ''))) STORED;
+
+CREATE INDEX IF NOT EXISTS review_text_search ON Review USING GIN (text_search);
+
+ANALYZE Review;
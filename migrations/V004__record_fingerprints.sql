@@ -0,0 +1,9 @@
+-- Fingerprint of every source record as last loaded, keyed by input file and
+-- the record's id (business_id, review_id or user_id). The loader's --delta
+-- mode compares each record against it and only rewrites new or changed ones.
+CREATE TABLE IF NOT EXISTS RecordFingerprint (
+    source          TEXT NOT NULL,
+    record_key      TEXT NOT NULL,
+    fingerprint     BYTEA NOT NULL,
+    PRIMARY KEY (source, record_key)
+);
@@ -0,0 +1,10 @@
+-- import_zipdata.sql stored zipcodes as numbers ('1001'), so New England
+-- zipcodes never matched Business.zipcode ('01001'). Pad the rows already
+-- loaded; Ryan_and_Stef_zipcodes.py pads them on every reload.
+DELETE FROM ZipcodeStats short
+WHERE length(short.zipcode) < 5
+  AND EXISTS (SELECT 1 FROM ZipcodeStats padded WHERE padded.zipcode = lpad(short.zipcode, 5, '0'));
+
+UPDATE ZipcodeStats SET zipcode = lpad(zipcode, 5, '0') WHERE length(zipcode) < 5;
+
+ANALYZE ZipcodeStats;